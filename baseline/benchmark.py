@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# DCASE 2016::Domestic Audio Tagging / Baseline System
+# Benchmarks for the computational blocks of the system
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from src.ui import *
+from src.general import *
+from src.files import *
+from src.features import *
+from src.gmm import *
+from src.sound_event_detection import *
+
+import sys
+import copy
+import time
+import numpy
+import argparse
+import textwrap
+
+from sklearn import mixture
+
+from task4_audio_tagging import process_parameters
+
+
+def benchmark_feature_extraction(params, clip_count=256, clip_length_seconds=4.0,
+                                 batch_sizes=(1, 2, 4, 8, 16, 32, 64, 128, 256)):
+    section_header('Feature extraction')
+
+    # Synthetic clips of equal length, like CHiME-Home chunks
+    random_state = numpy.random.RandomState(123456)
+    y_list = [random_state.uniform(-0.5, 0.5, int(clip_length_seconds * params['fs'])) for i in range(clip_count)]
+
+    feature_extractor = FeatureExtractor.from_params(params)
+
+    # Reference, per-file extraction
+    start_time = time.time()
+    reference = [feature_extractor.extract(y) for y in y_list]
+    reference_rate = clip_count / (time.time() - start_time)
+
+    print "  {:10s} | {:10s} | {:8s} | {:12s}".format('Batch size', 'Clips/sec', 'Speedup', 'Max abs diff')
+    print "  ==================================================="
+    print "  {:10s} | {:10.1f} | {:8.2f} | {:12s}".format('per-file', reference_rate, 1.0, '-')
+    for batch_size in batch_sizes:
+        start_time = time.time()
+        results = []
+        for batch_start in range(0, clip_count, batch_size):
+            results += feature_extractor.extract_batch(y_list[batch_start:batch_start + batch_size])
+        rate = clip_count / (time.time() - start_time)
+
+        difference = max(numpy.max(numpy.abs(result['feat'] - reference_result['feat']))
+                         for result, reference_result in zip(results, reference))
+
+        print "  {:10d} | {:10.1f} | {:8.2f} | {:12.3e}".format(batch_size, rate, rate / reference_rate, difference)
+    print "  ==================================================="
+
+
+def benchmark_gmm_scoring(params, model_count=14, clip_count=64, clip_frames=200, dimension=20,
+                          covariance_types=('diag', 'full')):
+    section_header('GMM scoring')
+
+    # Positive and negative models of all tags, trained shortly on synthetic data
+    random_state = numpy.random.RandomState(123456)
+    clips = [random_state.randn(clip_frames, dimension) for i in range(clip_count)]
+
+    print "  {:10s} | {:14s} | {:12s} | {:8s} | {:12s}".format('Covariance', 'Engine', 'Frames/sec', 'Speedup', 'Max abs diff')
+    print "  ======================================================================"
+    for covariance_type in covariance_types:
+        models = []
+        for model_id in range(2 * model_count):
+            model_params = dict(params)
+            model_params.pop('relevance_factor', None)
+            model_params.update({'covariance_type': covariance_type, 'n_iter': 5, 'random_state': model_id})
+            models.append(mixture.GMM(**model_params).fit(random_state.randn(2000, dimension) + random_state.randn(dimension)))
+
+        # Reference, model by model sklearn scoring
+        start_time = time.time()
+        reference = [numpy.array([numpy.sum(model.score(clip)) for model in models]) for clip in clips]
+        reference_rate = clip_count * clip_frames / (time.time() - start_time)
+        print "  {:10s} | {:14s} | {:12.1f} | {:8.2f} | {:12s}".format(covariance_type, 'sklearn', reference_rate, 1.0, '-')
+
+        for dtype in ['float64', 'float32']:
+            scorer = GMMScorer(models=models, dtype=dtype)
+            start_time = time.time()
+            results = [scorer.score(clip) for clip in clips]
+            rate = clip_count * clip_frames / (time.time() - start_time)
+
+            difference = max(numpy.max(numpy.abs(result - reference_result)) for result, reference_result in zip(results, reference))
+            print "  {:10s} | {:14s} | {:12.1f} | {:8.2f} | {:12.3e}".format(covariance_type, 'native ' + dtype, rate, rate / reference_rate, difference)
+    print "  ======================================================================"
+
+
+def benchmark_gmm_statistics(params, frame_count=20000, chunk_frames=2000, dimension=20,
+                             covariance_types=('diag', 'spherical', 'full', 'tied')):
+    section_header('GMM statistics')
+
+    # One EM iteration of sklearn against the statistics accumulated chunk by chunk. The last component is placed
+    # far from the data, so that it gets no responsibility, and the data is offset from zero.
+    random_state = numpy.random.RandomState(123456)
+    X = random_state.randn(frame_count, dimension) + 10.0
+    n_components = min(params['n_components'], 8)
+
+    print "  {:10s} | {:12s} | {:12s} | {:8s} | {:12s} | {:12s}".format('Covariance', 'Engine', 'Frames/sec', 'Speedup',
+                                                                       'Max abs diff', 'Empty diff')
+    print "  ==================================================================================="
+    for covariance_type in covariance_types:
+        model = mixture.GMM(n_components=n_components, covariance_type=covariance_type, n_iter=5,
+                            min_covar=params['min_covar'], random_state=0).fit(X)
+        model.means_[-1] += 1000.0
+
+        reference = copy.deepcopy(model)
+        reference.n_iter = 1
+        reference.init_params = ''
+        start_time = time.time()
+        reference.fit(X)
+        reference_rate = frame_count / (time.time() - start_time)
+
+        start_time = time.time()
+        statistics = GMMStatistics.from_model(model)
+        for chunk_start in range(0, frame_count, chunk_frames):
+            chunk_statistics = GMMStatistics.from_model(model)
+            chunk_statistics.accumulate(model, X[chunk_start:chunk_start + chunk_frames])
+            statistics.merge(chunk_statistics)
+        updated = statistics.update(model)
+        rate = frame_count / (time.time() - start_time)
+
+        difference = max(numpy.max(numpy.abs(getattr(updated, name) - getattr(reference, name)))
+                         for name in ['weights_', 'means_', 'covars_'])
+        if covariance_type == 'tied':
+            empty_difference = '-'
+        else:
+            empty_difference = '{:12.3e}'.format(numpy.max(numpy.abs(updated.covars_[-1] - reference.covars_[-1])))
+
+        print "  {:10s} | {:12s} | {:12.1f} | {:8.2f} | {:12s} | {:12s}".format(covariance_type, 'sklearn', reference_rate, 1.0, '-', '-')
+        print "  {:10s} | {:12s} | {:12.1f} | {:8.2f} | {:12.3e} | {:12s}".format(covariance_type, 'statistics', rate, rate / reference_rate,
+                                                                                 difference, empty_difference)
+    print "  ==================================================================================="
+    print "  [%d] components, the last one without responsibility, [%d] frames in chunks of [%d]" % (n_components, frame_count, chunk_frames)
+
+
+def benchmark_event_smoothing(params, label_count=7, duration_seconds=3600.0, smoothing_window_length_seconds=1.0,
+                              loop_duration_seconds=60.0):
+    section_header('Event smoothing')
+
+    # Synthetic frame log-likelihoods of the positive and negative models of all labels, one hour of audio
+    random_state = numpy.random.RandomState(123456)
+    frame_count = int(duration_seconds / params['hop_length_seconds'])
+    smoothing_window = int(smoothing_window_length_seconds / params['hop_length_seconds'])
+    log_likelihoods = random_state.randn(frame_count, 2 * label_count) - 30.0
+
+    # Reference, the earlier in-place smoothing loop label by label, timed over the beginning of the data
+    loop_frame_count = min(frame_count, int(loop_duration_seconds / params['hop_length_seconds']))
+    reference = numpy.array(log_likelihoods[:loop_frame_count])
+    start_time = time.time()
+    for likelihood in reference.T:
+        for stop_id in range(0, loop_frame_count):
+            start_id = stop_id - smoothing_window
+            if start_id < 0:
+                start_id = 0
+            likelihood[start_id] = sum(likelihood[start_id:stop_id])
+    reference_rate = loop_frame_count / (time.time() - start_time)
+
+    print "  {:18s} | {:12s} | {:10s} | {:12s}".format('Engine', 'Frames/sec', 'Speedup', 'Max abs diff')
+    print "  ==============================================================="
+    print "  {:18s} | {:12.1f} | {:10.2f} | {:12s}".format('loop', reference_rate, 1.0, '-')
+    for legacy in [True, False]:
+        start_time = time.time()
+        smoothed = moving_sum(log_likelihoods, window_length=smoothing_window, legacy=legacy)
+        rate = frame_count / (time.time() - start_time)
+
+        if legacy:
+            # Last window of the loop reference is left unsummed, the loop ran over the beginning of the data only
+            compared = loop_frame_count - smoothing_window
+            difference = '{:12.3e}'.format(numpy.max(numpy.abs(smoothed[:compared] - reference[:compared])))
+        else:
+            difference = '-'
+        print "  {:18s} | {:12.1f} | {:10.2f} | {:12s}".format('cumsum legacy' if legacy else 'cumsum causal', rate, rate / reference_rate, difference)
+    print "  ==============================================================="
+    print "  [%d] labels, [%.1f] hours of frames, loop timed over [%d] frames" % (label_count, duration_seconds / 3600.0, loop_frame_count)
+
+
+def postprocess_event_segments_loop(event_segments, minimum_event_length=0.1, minimum_event_gap=0.1):
+    # Earlier implementation of postrocess_event_segments, reference of the benchmark
+    event_results_1 = []
+    for event in event_segments:
+        if event[1]-event[0] >= minimum_event_length:
+            event_results_1.append((event[0], event[1]))
+
+    if len(event_results_1):
+        event_results_2 = []
+        buffered_event_onset = event_results_1[0][0]
+        buffered_event_offset = event_results_1[0][1]
+        for i in range(1,len(event_results_1)):
+            if event_results_1[i][0] - buffered_event_offset > minimum_event_gap:
+                event_results_2.append((buffered_event_onset, buffered_event_offset))
+                buffered_event_onset = event_results_1[i][0]
+                buffered_event_offset = event_results_1[i][1]
+            else:
+                buffered_event_offset = event_results_1[i][1]
+
+        event_results_2.append((buffered_event_onset, buffered_event_offset))
+        return event_results_2
+    else:
+        return event_results_1
+
+
+def benchmark_event_postprocessing(params, label_count=7, duration_seconds=3600.0, change_probability=0.05,
+                                   minimum_event_length=0.1, minimum_event_gap=0.1):
+    section_header('Event postprocessing')
+
+    # Synthetic dense event activity of all labels, one hour of frames
+    random_state = numpy.random.RandomState(123456)
+    frame_count = int(duration_seconds / params['hop_length_seconds'])
+    event_activity = numpy.cumsum(random_state.rand(frame_count, label_count) < change_probability, axis=0) % 2 == 1
+    event_labels = ['label%d' % label_id for label_id in range(label_count)]
+
+    # Reference, label by label regions and postprocessing loop, events appended one at a time
+    start_time = time.time()
+    reference = []
+    segment_count = 0
+    for label_id, event_label in enumerate(event_labels):
+        event_segments = contiguous_regions(event_activity[:, label_id]) * params['hop_length_seconds']
+        segment_count += event_segments.shape[0]
+        for event in postprocess_event_segments_loop(event_segments, minimum_event_length=minimum_event_length, minimum_event_gap=minimum_event_gap):
+            reference.append((event[0], event[1], event_label))
+    reference_rate = segment_count / (time.time() - start_time)
+
+    # Stacked regions of all labels, postprocessed at once, and the event list of event_detection built from them
+    start_time = time.time()
+    event_segments, event_label_ids = stacked_contiguous_regions(event_activity)
+    event_segments, event_label_ids = postprocess_event_segment_array(event_segments=event_segments * params['hop_length_seconds'],
+                                                                      event_label_ids=event_label_ids,
+                                                                      minimum_event_length=minimum_event_length,
+                                                                      minimum_event_gap=minimum_event_gap)
+    array_time = time.time() - start_time
+    results = zip(event_segments[:, 0], event_segments[:, 1], [event_labels[label_id] for label_id in event_label_ids])
+    list_time = time.time() - start_time
+
+    print "  {:18s} | {:12s} | {:10s} | {:10s}".format('Engine', 'Events/sec', 'Speedup', 'Identical')
+    print "  ============================================================="
+    print "  {:18s} | {:12.1f} | {:10.2f} | {:10s}".format('loop', reference_rate, 1.0, '-')
+    print "  {:18s} | {:12.1f} | {:10.2f} | {:10s}".format('stacked arrays', segment_count / array_time, segment_count / array_time / reference_rate, '-')
+    print "  {:18s} | {:12.1f} | {:10.2f} | {:10s}".format('stacked + list', segment_count / list_time, segment_count / list_time / reference_rate, str(results == reference))
+    print "  ============================================================="
+    print "  [%d] labels, [%d] event segments in, [%d] events out" % (label_count, segment_count, len(results))
+
+
+def main(argv):
+    benchmarks = ['feature_extraction', 'gmm_scoring', 'gmm_statistics', 'event_smoothing', 'event_postprocessing']
+
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''\
+            DCASE 2016
+            Task: Domestic Audio Tagging
+            Baseline System benchmarks
+            ---------------------------------------------
+                Runs the computational blocks of the system on synthetic data
+                with the parameters defined in task4_audio_tagging.yaml.
+        '''))
+    parser.add_argument('benchmark', nargs='*', default=benchmarks,
+                        help='Benchmarks to run, all by default [' + '|'.join(benchmarks) + ']')
+    args = parser.parse_args()
+
+    for benchmark in args.benchmark:
+        if benchmark not in benchmarks:
+            parser.error("Unknown benchmark [%s]" % benchmark)
+
+    # Load parameters from config file
+    params = load_parameters('task4_audio_tagging.yaml')
+    params = process_parameters(params, 'benchmark')
+
+    title("DCASE 2016::Domestic Audio Tagging / Benchmarks")
+
+    if 'feature_extraction' in args.benchmark:
+        benchmark_feature_extraction(params=params['features'])
+        foot()
+
+    if 'gmm_scoring' in args.benchmark:
+        benchmark_gmm_scoring(params=params['classifier_parameters']['gmm'])
+        foot()
+
+    if 'gmm_statistics' in args.benchmark:
+        benchmark_gmm_statistics(params=params['classifier_parameters']['gmm'])
+        foot()
+
+    if 'event_smoothing' in args.benchmark:
+        benchmark_event_smoothing(params=params['features'])
+        foot()
+
+    if 'event_postprocessing' in args.benchmark:
+        benchmark_event_postprocessing(params=params['features'])
+        foot()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
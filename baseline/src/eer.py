@@ -53,7 +53,18 @@ def compute_eer(result_filename, label, label_assignments):
     
     y_true = numpy.array([label_assignments[row[0]] for row in results])
     y_score = numpy.array([row[2] for row in results])
-    
+
+    return compute_eer_from_scores(y_true, y_score)
+
+def compute_eer_from_scores(y_true, y_score):
+    """Compute the equal error rate (EER) of one label from arrays of ground truth
+        assignments and scores, see compute_eer.
+
+    Keyword arguments:
+        y_true -- Ground truth assignments (0 or 1) about the presence of the label, one per file.
+        y_score -- Classification scores about the presence of the label, in the order of y_true.
+    """
+
     fpr, tpr, thresholds = metrics.roc_curve(y_true,y_score,drop_intermediate=True)
     
     eps = 1E-6
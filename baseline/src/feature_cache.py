@@ -0,0 +1,117 @@
+import os
+import hashlib
+
+from general import *
+from files import *
+
+
+def get_file_digest(filename, block_size=1024 * 1024):
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        block = f.read(block_size)
+        while block:
+            sha1.update(block)
+            block = f.read(block_size)
+    return sha1.hexdigest()
+
+
+def get_digest_item(audio_filename):
+    # Index item of an audio file, file size and modification time are taken before reading the content
+    file_stat = os.stat(audio_filename)
+    return {
+        'size': file_stat.st_size,
+        'mtime': file_stat.st_mtime,
+        'digest': get_file_digest(audio_filename),
+    }
+
+
+class FeatureCache(object):
+    """Content addressed feature cache
+
+    Feature files are named by the digest of the audio content, under the feature parameter hash directories,
+    so identical audio reached through different datasets or file names is extracted only once. Digests are
+    kept in a persistent index mapping audio paths to digests, entries are validated by file size and
+    modification time. Feature file modification times are updated on use, and used for least recently used
+    eviction.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index_file = os.path.join(path, 'audio_digest_index.cpickle')
+        self.index = {}
+        self.modified = False
+
+        if os.path.isfile(self.index_file):
+            self.index = load_data(self.index_file)
+
+    def digest(self, audio_filename):
+        digest = self.cached_digest(audio_filename)
+        if digest is None:
+            audio_filename = os.path.abspath(audio_filename)
+            self.add(audio_filename, get_digest_item(audio_filename))
+            digest = self.index[audio_filename]['digest']
+
+        return digest
+
+    def cached_digest(self, audio_filename):
+        # Digest from the index without reading the audio, None when the file is not indexed or changed since
+        audio_filename = os.path.abspath(audio_filename)
+        file_stat = os.stat(audio_filename)
+
+        item = self.index.get(audio_filename)
+        if item is None or item['size'] != file_stat.st_size or item['mtime'] != file_stat.st_mtime:
+            return None
+        return item['digest']
+
+    def add(self, audio_filename, item):
+        # Store index item computed elsewhere, e.g. with get_digest_item in a worker process
+        self.index[os.path.abspath(audio_filename)] = item
+        self.modified = True
+
+    def save(self):
+        if self.modified:
+            check_path(self.path)
+            temp_filename = self.index_file + '.tmp'
+            save_data(temp_filename, self.index)
+            os.rename(temp_filename, self.index_file)
+            self.modified = False
+
+    def touch(self, feature_filename):
+        # Mark feature file used
+        os.utime(feature_filename, None)
+
+    def feature_files(self):
+        files = []
+        if os.path.isdir(self.path):
+            for feature_hash in os.listdir(self.path):
+                feature_path = os.path.join(self.path, feature_hash)
+                if os.path.isdir(feature_path):
+                    for feature_file in os.listdir(feature_path):
+                        if feature_file.endswith('.cpickle') and not feature_file.startswith('feature_store'):
+                            files.append(os.path.join(feature_path, feature_file))
+        return files
+
+    def evict(self, max_size):
+        """Remove least recently used feature files until the cache fits into given size
+
+        :param max_size: maximum size of the cache in bytes
+        :return: number of removed files, number of removed bytes, cache size after eviction
+        """
+        files = []
+        for feature_file in self.feature_files():
+            file_stat = os.stat(feature_file)
+            files.append((file_stat.st_mtime, file_stat.st_size, feature_file))
+        files.sort()
+
+        cache_size = sum(file_size for last_used, file_size, feature_file in files)
+        removed_count = 0
+        removed_size = 0
+        for last_used, file_size, feature_file in files:
+            if cache_size <= max_size:
+                break
+            os.remove(feature_file)
+            cache_size -= file_size
+            removed_count += 1
+            removed_size += file_size
+
+        return removed_count, removed_size, cache_size
@@ -0,0 +1,121 @@
+import os
+import numpy
+
+from files import *
+
+
+class FeatureStore(object):
+    """Consolidated feature storage
+
+    Feature matrices of all audio files are stored into one contiguous raw data file, and an index maps
+    the audio content digest (see FeatureCache) to the position of the matrix inside the data file. Feature matrices are read
+    as zero-copy slices of a memory map.
+    """
+
+    def __init__(self, path, dtype='float32'):
+        self.path = path
+        self.data_file = os.path.join(path, 'feature_store.raw')
+        self.index_file = os.path.join(path, 'feature_store_index.cpickle')
+
+        self.dtype = numpy.dtype(dtype)
+        self.dimension = None
+        self.frame_count = 0
+        self.items = {}
+        self.memmap = None
+
+        if os.path.isfile(self.index_file):
+            index = load_data(self.index_file)
+            self.dtype = numpy.dtype(index['dtype'])
+            self.dimension = index['dimension']
+            self.frame_count = index['frame_count']
+            self.items = index['items']
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def exists(self):
+        return os.path.isfile(self.index_file)
+
+    def append(self, items):
+        """Append feature data into the store
+
+        :param items: iterable of (key, feature_data) tuples, feature_data as returned by feature_extraction
+        :return: nothing
+        """
+        if not os.path.isfile(self.data_file):
+            open(self.data_file, 'wb').close()
+
+        with open(self.data_file, 'r+b') as f:
+            # Drop data not covered by the index, e.g. left over from interrupted run
+            f.truncate(self.frame_count * self.row_bytes)
+            f.seek(0, os.SEEK_END)
+
+            for key, feature_data in items:
+                feature_matrix = numpy.ascontiguousarray(feature_data['feat'], dtype=self.dtype)
+                if self.dimension is None:
+                    self.dimension = feature_matrix.shape[1]
+                elif feature_matrix.shape[1] != self.dimension:
+                    raise ValueError("Feature dimension mismatch [%s]" % key)
+
+                feature_matrix.tofile(f)
+
+                # Replaced items leave their old data unreferenced in the data file
+                self.items[key] = {
+                    'offset': self.frame_count,
+                    'length': feature_matrix.shape[0],
+                    'stat': feature_data['stat'],
+                }
+                self.frame_count += feature_matrix.shape[0]
+
+        self.memmap = None
+        self.save_index()
+
+    def save_index(self):
+        temp_filename = self.index_file + '.tmp'
+        save_data(temp_filename, {
+            'dtype': self.dtype.str,
+            'dimension': self.dimension,
+            'frame_count': self.frame_count,
+            'items': self.items,
+        })
+        os.rename(temp_filename, self.index_file)
+
+    def clear(self):
+        for filename in [self.data_file, self.index_file]:
+            if os.path.isfile(filename):
+                os.remove(filename)
+
+        self.dimension = None
+        self.frame_count = 0
+        self.items = {}
+        self.memmap = None
+
+    @property
+    def row_bytes(self):
+        if self.dimension is None:
+            return 0
+        return self.dimension * self.dtype.itemsize
+
+    @property
+    def data(self):
+        if self.memmap is None and self.frame_count:
+            self.memmap = numpy.memmap(self.data_file, dtype=self.dtype, mode='r',
+                                       shape=(self.frame_count, self.dimension))
+        return self.memmap
+
+    def feat(self, key):
+        item = self.items[key]
+        return self.data[item['offset']:item['offset'] + item['length']]
+
+    def stat(self, key):
+        return self.items[key]['stat']
+
+    def load(self, key):
+        return {
+            'feat': self.feat(key),
+            'stat': self.stat(key),
+        }
@@ -4,103 +4,354 @@ import scipy
 
 def feature_extraction(y=None, fs=None, statistics=True, include_mfcc0=True, include_delta=True, include_acceleration=True, mfcc_params=None, delta_params=None, acceleration_params=None):
     # Extract features, Mel Frequency Cepstral Coefficients
-    eps = numpy.spacing(1)
+    feature_extractor = FeatureExtractor(fs=fs,
+                                         include_mfcc0=include_mfcc0,
+                                         include_delta=include_delta,
+                                         include_acceleration=include_acceleration,
+                                         mfcc_params=mfcc_params,
+                                         delta_params=delta_params,
+                                         acceleration_params=acceleration_params)
 
+    return feature_extractor.extract(y, statistics=statistics)
+
+
+def get_window(window_type, n_fft):
     # Windowing function
-    if mfcc_params['window'] == 'hamming_asymmetric':
-        window = scipy.signal.hamming(mfcc_params['n_fft'], sym=False)
-    elif mfcc_params['window'] == 'hamming_symmetric':
-        window = scipy.signal.hamming(mfcc_params['n_fft'], sym=True)
-    elif mfcc_params['window'] == 'hann_asymmetric':
-        window = scipy.signal.hann(mfcc_params['n_fft'], sym=False)
-    elif mfcc_params['window'] == 'hann_symmetric':
-        window = scipy.signal.hann(mfcc_params['n_fft'], sym=True)
+    if window_type == 'hamming_asymmetric':
+        return scipy.signal.hamming(n_fft, sym=False)
+    elif window_type == 'hamming_symmetric':
+        return scipy.signal.hamming(n_fft, sym=True)
+    elif window_type == 'hann_asymmetric':
+        return scipy.signal.hann(n_fft, sym=False)
+    elif window_type == 'hann_symmetric':
+        return scipy.signal.hann(n_fft, sym=True)
     else:
-        window = None
-
-    # Calculate Static Coefficients
-    magnitude_spectrogram = numpy.abs(librosa.stft(y + eps, n_fft=mfcc_params['n_fft'], win_length=mfcc_params['win_length'], hop_length=mfcc_params['hop_length'], window=window))**2
-    mel_basis = librosa.filters.mel(sr=fs, n_fft=mfcc_params['n_fft'], n_mels=mfcc_params['n_mels'], fmin=mfcc_params['fmin'], fmax=mfcc_params['fmax'], htk=mfcc_params['htk'])
-    mel_spectrum = numpy.dot(mel_basis, magnitude_spectrogram)
-    mfcc = librosa.feature.mfcc(S=librosa.logamplitude(mel_spectrum))
-
-    # Collect the feature matrix
-    feature_matrix = mfcc
-    if include_delta:
-        # Delta coefficients
-        mfcc_delta = librosa.feature.delta(mfcc, **delta_params)
-
-        # Add Delta Coefficients to feature matrix
-        feature_matrix = numpy.vstack((feature_matrix, mfcc_delta))
-
-    if include_acceleration:
-        # Acceleration coefficients (aka delta)
-        mfcc_delta2 = librosa.feature.delta(mfcc, order=2, **acceleration_params)
-
-        # Add Acceleration Coefficients to feature matrix
-        feature_matrix = numpy.vstack((feature_matrix, mfcc_delta2))
-
-
-    if not include_mfcc0:
-        # Omit mfcc0
-        feature_matrix = feature_matrix[1:, :]
-
-    feature_matrix = feature_matrix.T
-
-    # Collect into data structure
-    if statistics:
-        return {
-            'feat': feature_matrix,
-            'stat': {
-                'mean': numpy.mean(feature_matrix, axis=0),
-                'std': numpy.std(feature_matrix, axis=0),
-                'N': feature_matrix.shape[0],
-                'S1': numpy.sum(feature_matrix, axis=0),
-                'S2': numpy.sum(feature_matrix ** 2, axis=0),
+        return None
+
+
+def extract_feature_variants(y_list, feature_extractors, statistics=True):
+    """
+    Extract features with several feature extractors sharing the STFT parameters
+
+    Power spectrogram is computed once per clip and all feature variants are derived from it. Clips of
+    equal length are transformed together.
+
+    :param y_list: list of audio signals
+    :param feature_extractors: list of FeatureExtractor with equal stft_params
+    :param statistics: include statistics into feature data
+    :return: list of feature data lists, one list per extractor, in order of y_list
+    """
+    reference = feature_extractors[0]
+    for feature_extractor in feature_extractors:
+        if feature_extractor.stft_params != reference.stft_params:
+            raise ValueError("Feature extractors do not share STFT parameters")
+
+    results = [[None] * len(y_list) for feature_extractor in feature_extractors]
+    clip_groups = {}
+    for clip_id, y in enumerate(y_list):
+        clip_groups.setdefault(len(y), []).append(clip_id)
+
+    for length, clip_ids in clip_groups.items():
+        if len(clip_ids) == 1:
+            magnitude_spectrogram = reference.power_spectrogram(y_list[clip_ids[0]])
+            for extractor_id, feature_extractor in enumerate(feature_extractors):
+                results[extractor_id][clip_ids[0]] = feature_extractor.extract_from_power_spectrogram(magnitude_spectrogram,
+                                                                                                      statistics=statistics)
+        else:
+            magnitude_spectrogram = reference.power_spectrogram_batch(numpy.vstack([y_list[clip_id] for clip_id in clip_ids]))
+            for extractor_id, feature_extractor in enumerate(feature_extractors):
+                feature_data_list = feature_extractor.extract_from_power_spectrogram_batch(magnitude_spectrogram,
+                                                                                          statistics=statistics)
+                for clip_id, feature_data in zip(clip_ids, feature_data_list):
+                    results[extractor_id][clip_id] = feature_data
+
+    return results
+
+
+class FeatureExtractor(object):
+    # Log compression parameters, librosa.logamplitude defaults
+    amin = 1e-10
+    top_db = 80.0
+
+    def __init__(self, fs=None, include_mfcc0=True, include_delta=True, include_acceleration=True, mfcc_params=None, delta_params=None, acceleration_params=None):
+        self.fs = fs
+        self.include_mfcc0 = include_mfcc0
+        self.include_delta = include_delta
+        self.include_acceleration = include_acceleration
+        self.mfcc_params = mfcc_params
+        self.delta_params = delta_params
+        self.acceleration_params = acceleration_params
+
+        self.eps = numpy.spacing(1)
+
+        # Audio independent parts of the extraction are computed only once
+        self.window = get_window(mfcc_params['window'], mfcc_params['n_fft'])
+        self.mel_basis = librosa.filters.mel(sr=fs,
+                                             n_fft=mfcc_params['n_fft'],
+                                             n_mels=mfcc_params['n_mels'],
+                                             fmin=mfcc_params['fmin'],
+                                             fmax=mfcc_params['fmax'],
+                                             htk=mfcc_params['htk'])
+        self.n_mfcc = mfcc_params['n_mfcc']
+        self.dct_basis = librosa.filters.dct(self.n_mfcc, mfcc_params['n_mels'])
+
+        # Work buffers, reallocated only when the number of frames changes
+        self.mel_spectrum = None
+        self.mfcc = None
+
+    @classmethod
+    def from_params(cls, params):
+        # Build from the features section of the parameters
+        return cls(fs=params['fs'],
+                   include_mfcc0=params['include_mfcc0'],
+                   include_delta=params['include_delta'],
+                   include_acceleration=params['include_acceleration'],
+                   mfcc_params=params['mfcc'],
+                   delta_params=params['mfcc_delta'],
+                   acceleration_params=params['mfcc_acceleration'])
+
+    @property
+    def stft_params(self):
+        # Extractors with equal STFT parameters can share the power spectrogram
+        return (self.fs,
+                self.mfcc_params['n_fft'],
+                self.mfcc_params['win_length'],
+                self.mfcc_params['hop_length'],
+                self.mfcc_params['window'])
+
+    def power_spectrogram(self, y):
+        return numpy.abs(librosa.stft(y + self.eps,
+                                      n_fft=self.mfcc_params['n_fft'],
+                                      win_length=self.mfcc_params['win_length'],
+                                      hop_length=self.mfcc_params['hop_length'],
+                                      window=self.window))**2
+
+    def extract(self, y, statistics=True):
+        return self.extract_from_power_spectrogram(self.power_spectrogram(y), statistics=statistics)
+
+    def extract_batch(self, y_list, statistics=True):
+        # Clips of equal length are transformed together, results match extract() within floating-point tolerance
+        return extract_feature_variants(y_list, [self], statistics=statistics)[0]
+
+    def fft_window(self):
+        # Analysis window padded out to n_fft size, like in librosa.stft
+        n_fft = self.mfcc_params['n_fft']
+
+        window = self.window
+        if window is None:
+            # librosa.stft default, asymmetric Hann window of win_length
+            window = scipy.signal.hann(self.mfcc_params['win_length'], sym=False)
+
+        left_padding = (n_fft - len(window)) // 2
+        return numpy.pad(window, (left_padding, n_fft - len(window) - left_padding), mode='constant')
+
+    def power_spectrogram_batch(self, y_batch):
+        # Power spectrograms of equal length clips (clips in rows), shape (clips, frames, frequency bins)
+        n_fft = self.mfcc_params['n_fft']
+        hop_length = self.mfcc_params['hop_length']
+        window = self.fft_window()
+
+        # Pad the clips so that frames are centered, like librosa.stft
+        y_batch = numpy.pad(y_batch + self.eps, ((0, 0), (n_fft // 2, n_fft // 2)), mode='reflect')
+
+        # Frame all clips with a strided view, and transform them with one FFT call
+        frame_count = 1 + (y_batch.shape[1] - n_fft) // hop_length
+        frames = numpy.lib.stride_tricks.as_strided(y_batch,
+                                                    shape=(y_batch.shape[0], frame_count, n_fft),
+                                                    strides=(y_batch.strides[0], hop_length * y_batch.strides[1], y_batch.strides[1]))
+
+        spectrum = numpy.fft.rfft(frames * window, axis=-1)
+        return spectrum.real ** 2 + spectrum.imag ** 2
+
+    def extract_from_batch(self, y_batch, statistics=True):
+        return self.extract_from_power_spectrogram_batch(self.power_spectrogram_batch(y_batch), statistics=statistics)
+
+    def extract_from_power_spectrogram_batch(self, magnitude_spectrogram, statistics=True):
+        # Mel projection over all clips and frames
+        mel_spectrum = numpy.dot(magnitude_spectrogram, self.mel_basis.T)
+
+        # Log compression in place, top_db threshold is taken per clip
+        numpy.maximum(mel_spectrum, self.amin, out=mel_spectrum)
+        numpy.log10(mel_spectrum, out=mel_spectrum)
+        mel_spectrum *= 10.0
+        clip_max = mel_spectrum.reshape(mel_spectrum.shape[0], -1).max(axis=1)
+        numpy.maximum(mel_spectrum, (clip_max - self.top_db)[:, numpy.newaxis, numpy.newaxis], out=mel_spectrum)
+
+        # Static coefficients of all clips, shape (clips, frames, coefficients)
+        mfcc = numpy.dot(mel_spectrum, self.dct_basis.T)
+
+        return [self.collect(numpy.ascontiguousarray(clip_mfcc.T), statistics=statistics) for clip_mfcc in mfcc]
+
+    def extract_from_power_spectrogram(self, magnitude_spectrogram, statistics=True):
+        frame_count = magnitude_spectrogram.shape[1]
+        if self.mel_spectrum is None or self.mel_spectrum.shape[1] != frame_count:
+            self.mel_spectrum = numpy.empty((self.mel_basis.shape[0], frame_count),
+                                            dtype=numpy.result_type(self.mel_basis, magnitude_spectrogram))
+            self.mfcc = numpy.empty((self.dct_basis.shape[0], frame_count),
+                                    dtype=numpy.result_type(self.dct_basis, self.mel_spectrum))
+
+        # Mel projection
+        numpy.dot(self.mel_basis, magnitude_spectrogram, out=self.mel_spectrum)
+
+        # Log compression in place, same as librosa.logamplitude with ref_power=1.0
+        numpy.maximum(self.mel_spectrum, self.amin, out=self.mel_spectrum)
+        numpy.log10(self.mel_spectrum, out=self.mel_spectrum)
+        self.mel_spectrum *= 10.0
+        numpy.maximum(self.mel_spectrum, self.mel_spectrum.max() - self.top_db, out=self.mel_spectrum)
+
+        # Static coefficients, copied out of the work buffer
+        numpy.dot(self.dct_basis, self.mel_spectrum, out=self.mfcc)
+
+        return self.collect(self.mfcc.copy(), statistics=statistics)
+
+    def collect(self, mfcc, statistics=True):
+        # Collect the feature matrix
+        feature_matrix = mfcc
+        if self.include_delta:
+            # Delta coefficients
+            mfcc_delta = librosa.feature.delta(mfcc, **self.delta_params)
+
+            # Add Delta Coefficients to feature matrix
+            feature_matrix = numpy.vstack((feature_matrix, mfcc_delta))
+
+        if self.include_acceleration:
+            # Acceleration coefficients (aka delta)
+            mfcc_delta2 = librosa.feature.delta(mfcc, order=2, **self.acceleration_params)
+
+            # Add Acceleration Coefficients to feature matrix
+            feature_matrix = numpy.vstack((feature_matrix, mfcc_delta2))
+
+        if not self.include_mfcc0:
+            # Omit mfcc0
+            feature_matrix = feature_matrix[1:, :]
+
+        feature_matrix = feature_matrix.T
+
+        # Collect into data structure
+        if statistics:
+            return {
+                'feat': feature_matrix,
+                'stat': {
+                    'mean': numpy.mean(feature_matrix, axis=0),
+                    'std': numpy.std(feature_matrix, axis=0),
+                    'N': feature_matrix.shape[0],
+                    'S1': numpy.sum(feature_matrix, axis=0),
+                    'S2': numpy.sum(feature_matrix ** 2, axis=0),
+                }
             }
-        }
-    else:
-        return {
-            'feat': feature_matrix}
+        else:
+            return {
+                'feat': feature_matrix}
 
 
 class FeatureNormalizer(object):
+    """Feature normalizer
+
+    Statistics are stored as frame count (N), mean (mu) and sum of squared deviations from the mean (M2),
+    and merged with the parallel update of Chan et al., which avoids the cancellation of the sum of squares
+    formulation. Partial normalizers (e.g. per worker or per fold) can be combined with merge().
+    """
+
     def __init__(self, feature_matrix=None):
         if feature_matrix is None:
-            self.N = 0
-            self.mean = 0
-            self.S1 = 0
-            self.S2 = 0
-            self.std = 0
+            self.reset()
         else:
-            self.mean = numpy.mean(feature_matrix, axis=0)
-            self.std = numpy.std(feature_matrix, axis=0)
             self.N = feature_matrix.shape[0]
-            self.S1 = numpy.sum(feature_matrix, axis=0)
-            self.S2 = numpy.sum(feature_matrix ** 2, axis=0)
+            self.mu = numpy.mean(feature_matrix, axis=0)
+            self.M2 = numpy.sum((feature_matrix - self.mu) ** 2, axis=0)
+            self.mean = 0
+            self.std = 0
             self.finalize()
 
     def __enter__(self):
-        self.N = 0
-        self.mean = 0
-        self.S1 = 0
-        self.S2 = 0
-        self.std = 0
+        self.reset()
         return self
 
     def __exit__(self, type, value, traceback):
         self.finalize()
 
+    def __setstate__(self, state):
+        if 'M2' not in state:
+            # Normalizer stored with sum and sum of squares statistics
+            S1 = state.pop('S1', 0)
+            S2 = state.pop('S2', 0)
+            if state.get('N', 0) > 0:
+                state['mu'] = numpy.reshape(S1 / float(state['N']), [-1])
+                state['M2'] = numpy.reshape(S2 - S1 * S1 / float(state['N']), [-1])
+            else:
+                state['mu'] = 0
+                state['M2'] = 0
+
+        self.__dict__.update(state)
+
+    def reset(self):
+        self.N = 0
+        self.mu = 0
+        self.M2 = 0
+        self.mean = 0
+        self.std = 0
+
+    @property
+    def S1(self):
+        return self.N * self.mu
+
+    @property
+    def S2(self):
+        return self.M2 + self.N * self.mu * self.mu
+
     def accumulate(self, stat):
-        self.N += stat['N']
-        self.mean += stat['mean']
-        self.S1 += stat['S1']
-        self.S2 += stat['S2']
+        if stat['N'] == 0:
+            return
+
+        if 'mean' in stat and 'std' in stat:
+            # Per-file mean and population std, M2 without going through the sum of squares
+            mu = stat['mean']
+            M2 = stat['N'] * numpy.asarray(stat['std']) ** 2
+        else:
+            mu = stat['S1'] / float(stat['N'])
+            M2 = stat['S2'] - stat['S1'] * stat['S1'] / float(stat['N'])
+
+        self.merge_statistics(N=stat['N'], mu=mu, M2=M2)
+
+    def merge(self, normalizer):
+        # Combine statistics accumulated into another normalizer
+        self.merge_statistics(N=normalizer.N, mu=normalizer.mu, M2=normalizer.M2)
+
+    def merge_statistics(self, N, mu, M2):
+        if N == 0:
+            return
+
+        if self.N == 0:
+            self.N = N
+            self.mu = numpy.array(mu, dtype=numpy.float64)
+            self.M2 = numpy.array(M2, dtype=numpy.float64)
+        else:
+            total = self.N + N
+            delta = mu - self.mu
+            self.mu = self.mu + delta * (N / float(total))
+            self.M2 = self.M2 + M2 + delta * delta * (self.N * float(N) / total)
+            self.N = total
+
+    def subtract(self, normalizer):
+        # Remove statistics accumulated into another normalizer, reverse of merge()
+        if normalizer.N == 0:
+            return
+
+        remaining = self.N - normalizer.N
+        if remaining <= 0:
+            self.reset()
+            return
+
+        mu = (self.N * self.mu - normalizer.N * normalizer.mu) / float(remaining)
+        delta = normalizer.mu - mu
+        self.M2 = self.M2 - normalizer.M2 - delta * delta * (remaining * float(normalizer.N) / self.N)
+        self.mu = mu
+        self.N = remaining
 
     def finalize(self):
         # Finalize statistics
-        self.mean = self.S1 / self.N
-        self.std = numpy.sqrt((self.N * self.S2 - (self.S1 * self.S1)) / (self.N * (self.N - 1)))
+        self.mean = self.mu
+        self.std = numpy.sqrt(numpy.maximum(self.M2, 0) / (self.N - 1))
 
         # In case we have very brain-death material we get std = Nan => 0.0
         self.std = numpy.nan_to_num(self.std)
@@ -108,5 +359,105 @@ class FeatureNormalizer(object):
         self.mean = numpy.reshape(self.mean, [1, -1])
         self.std = numpy.reshape(self.std, [1, -1])
 
-    def normalize(self, feature_matrix):
-        return (feature_matrix - self.mean) / self.std
+    def normalize(self, feature_matrix, out=None):
+        if out is None:
+            return (feature_matrix - self.mean) / self.std
+        else:
+            # Normalize into given buffer without temporary copies
+            numpy.subtract(feature_matrix, self.mean, out=out)
+            numpy.divide(out, self.std, out=out)
+            return out
+
+
+class FrameBuffer(object):
+    def __init__(self, frame_count, dimension, dtype=numpy.float64, filename=None):
+        # Buffer is allocated once, feature matrices are copied into it in place. With filename the buffer is
+        # a memory mapped .npy file, which other processes can open with numpy.load(filename, mmap_mode='r').
+        if filename is not None:
+            self.data = numpy.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=(frame_count, dimension))
+        else:
+            self.data = numpy.empty((frame_count, dimension), dtype=dtype)
+        self.offsets = [0]
+
+    @property
+    def frame_count(self):
+        return self.offsets[-1]
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def append(self, feature_matrix, normalizer=None):
+        start = self.offsets[-1]
+        stop = start + feature_matrix.shape[0]
+        if stop > self.data.shape[0]:
+            raise ValueError("Frame buffer overflow, buffer allocated for [%d] frames" % self.data.shape[0])
+
+        if normalizer is not None:
+            normalizer.normalize(feature_matrix, out=self.data[start:stop])
+        else:
+            self.data[start:stop] = feature_matrix
+
+        self.offsets.append(stop)
+
+    def finalize(self):
+        if self.frame_count != self.data.shape[0]:
+            raise ValueError("Frame buffer not filled, [%d] frames out of [%d]" % (self.frame_count, self.data.shape[0]))
+
+        if isinstance(self.data, numpy.memmap):
+            self.data.flush()
+
+        return self.data, numpy.array(self.offsets)
+
+
+class FrameReservoir(object):
+    def __init__(self, capacity, dimension, file_count, dtype=numpy.float64, random_state=None):
+        # Uniform sample of at most capacity frames out of all appended frames, reservoir sampling keeps
+        # the memory bounded without knowing the total frame count in advance
+        self.data = numpy.empty((capacity, dimension), dtype=dtype)
+        self.file_ids = numpy.empty(capacity, dtype=numpy.int64)
+        self.file_frame_counts = numpy.zeros(file_count, dtype=numpy.int64)
+        self.seen = 0
+
+        if random_state is None or isinstance(random_state, (int, long)):
+            random_state = numpy.random.RandomState(random_state)
+        self.random_state = random_state
+
+    @property
+    def capacity(self):
+        return self.data.shape[0]
+
+    @property
+    def kept(self):
+        return min(self.seen, self.capacity)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.file_ids.nbytes
+
+    def append(self, feature_matrix, file_id):
+        frame_count = feature_matrix.shape[0]
+
+        # Fill the free slots first
+        free = max(min(self.capacity - self.seen, frame_count), 0)
+        if free:
+            self.data[self.seen:self.seen + free] = feature_matrix[:free]
+            self.file_ids[self.seen:self.seen + free] = file_id
+
+        if frame_count > free:
+            # Frame with running index i replaces a random slot with probability capacity / (i + 1)
+            frame_index = numpy.arange(self.seen + free, self.seen + frame_count)
+            slots = (self.random_state.random_sample(frame_count - free) * (frame_index + 1)).astype(numpy.int64)
+            accepted = slots < self.capacity
+            self.data[slots[accepted]] = feature_matrix[free:][accepted]
+            self.file_ids[slots[accepted]] = file_id
+
+        self.file_frame_counts[file_id] += frame_count
+        self.seen += frame_count
+
+    def finalize(self):
+        # Order the sample by file, frames of file i are stored in rows file_offsets[i]:file_offsets[i+1]
+        order = numpy.argsort(self.file_ids[:self.kept], kind='mergesort')
+        file_offsets = numpy.searchsorted(self.file_ids[:self.kept][order], numpy.arange(len(self.file_frame_counts) + 1))
+
+        return self.data[:self.kept][order], file_offsets
@@ -1,53 +1,30 @@
 import os
-import wave
+import struct
 import numpy
 import csv
 import cPickle as pickle
 import librosa
 import yaml
 
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
 
-def load_audio(filename, mono=True, fs=44100):
-    file_base, file_extension = os.path.splitext(filename)
-    if file_extension == '.wav':
-        audio_file = wave.open(filename)
-
-        # Audio info
-        sample_rate = audio_file.getframerate()
-        sample_width = audio_file.getsampwidth()
-        number_of_channels = audio_file.getnchannels()
-        number_of_frames = audio_file.getnframes()
-
-        # Read raw bytes
-        data = audio_file.readframes(number_of_frames)
-        audio_file.close()
 
-        # Convert bytes based on sample_width
-        num_samples, remainder = divmod(len(data), sample_width * number_of_channels)
-        if remainder > 0:
-            raise ValueError('The length of data is not a multiple of sample size * number of channels.')
-        if sample_width > 4:
-            raise ValueError('Sample size cannot be bigger than 4 bytes.')
-
-        if sample_width == 3:
-            # 24 bit audio
-            a = numpy.empty((num_samples, number_of_channels, 4), dtype=numpy.uint8)
-            raw_bytes = numpy.fromstring(data, dtype=numpy.uint8)
-            a[:, :, :sample_width] = raw_bytes.reshape(-1, number_of_channels, sample_width)
-            a[:, :, sample_width:] = (a[:, :, sample_width - 1:sample_width] >> 7) * 255
-            array = a.view('<i4').reshape(a.shape[:-1]).T
-        else:
-            # 8 bit samples are stored as unsigned ints; others as signed ints.
-            dt_char = 'u' if sample_width == 1 else 'i'
-            a = numpy.fromstring(data, dtype='<%s%d' % (dt_char, sample_width))
-            array = a.reshape(-1, number_of_channels).T
+def load_audio(filename, mono=True, fs=44100, offset=0, duration=None, out=None):
+    """
+    Load audio file
 
-        if mono:
-            # Down-mix audio
-            array = numpy.mean(array, axis=0)
-
-        # Convert int values into float
-        array = array / float(2 ** (sample_width * 8 - 1) + 1)
+    :param filename: audio file
+    :param mono: down-mix audio into one channel
+    :param fs: target sampling rate, audio is resampled if needed
+    :param offset: start position of the read in samples (at the sampling rate of the file)
+    :param duration: length of the read in samples (at the sampling rate of the file), None reads until the end
+    :param out: optional buffer for the audio (wav files only), filled at the sampling rate of the file
+    :return: audio data and sampling rate
+    """
+    file_base, file_extension = os.path.splitext(filename)
+    if file_extension == '.wav':
+        array, sample_rate = load_wav(filename=filename, mono=mono, offset=offset, duration=duration, out=out)
 
         if (fs != sample_rate):
             array = librosa.core.resample(array, sample_rate, fs)
@@ -56,13 +33,154 @@ def load_audio(filename, mono=True, fs=44100):
         return array, sample_rate
 
     elif file_extension == '.flac':
-        array, sample_rate = librosa.load(filename, sr=fs, mono=mono)
+        if offset or duration is not None:
+            array, sample_rate = librosa.load(filename, sr=None, mono=mono)
+            array = array[..., offset:(offset + duration if duration is not None else None)]
+            if (fs != sample_rate):
+                array = librosa.core.resample(array, sample_rate, fs)
+                sample_rate = fs
+        else:
+            array, sample_rate = librosa.load(filename, sr=fs, mono=mono)
 
         return array, sample_rate
 
     return None, None
 
 
+def read_wav_header(filename):
+    """
+    Parse RIFF/WAVE header and locate the data chunk
+
+    :param filename: wav file
+    :return: dict with sample_rate, channels, sample_width, data_offset (bytes) and frame_count
+    """
+    with open(filename, 'rb') as f:
+        riff_id, riff_size, wave_id = struct.unpack('<4sI4s', f.read(12))
+        if riff_id != b'RIFF' or wave_id != b'WAVE':
+            raise ValueError("Not a RIFF/WAVE file [%s]" % filename)
+
+        header = None
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                raise ValueError("Data chunk missing [%s]" % filename)
+
+            chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+            if chunk_id == b'fmt ':
+                chunk = f.read(chunk_size)
+                format_tag, channels, sample_rate, byte_rate, block_align, bits_per_sample = struct.unpack('<HHIIHH', chunk[:16])
+                if format_tag == WAVE_FORMAT_EXTENSIBLE and len(chunk) >= 26:
+                    # Actual format is given by the first two bytes of the sub format GUID
+                    format_tag = struct.unpack('<H', chunk[24:26])[0]
+
+                if format_tag != WAVE_FORMAT_PCM:
+                    raise ValueError("Only PCM wav files are supported [%s]" % filename)
+
+                header = {
+                    'sample_rate': sample_rate,
+                    'channels': channels,
+                    'sample_width': (bits_per_sample + 7) // 8,
+                }
+                # Chunks are word aligned
+                f.seek(chunk_size % 2, os.SEEK_CUR)
+
+            elif chunk_id == b'data':
+                if header is None:
+                    raise ValueError("Format chunk missing [%s]" % filename)
+
+                header['data_offset'] = f.tell()
+
+                # Trust file size over the chunk size, streaming writers do not always update the header
+                data_size = min(chunk_size, os.fstat(f.fileno()).st_size - header['data_offset'])
+                header['frame_count'] = data_size // (header['sample_width'] * header['channels'])
+                return header
+
+            else:
+                f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+
+
+def load_wav(filename, mono=True, offset=0, duration=None, out=None, block_size=65536):
+    """
+    Load PCM wav file through a memory map
+
+    Data chunk is mapped into memory and converted block-wise, down-mixing and scaling into the output buffer
+    happen in the same pass, so no full-length temporary copies are made.
+
+    :param filename: wav file
+    :param mono: down-mix audio into one channel
+    :param offset: start position of the read in samples
+    :param duration: length of the read in samples, None reads until the end
+    :param out: optional output buffer, shape (samples,) when mono else (channels, samples), any float dtype.
+        Allocated as float64 if not given.
+    :param block_size: number of samples converted at once
+    :return: audio data and sampling rate
+    """
+    header = read_wav_header(filename)
+    sample_width = header['sample_width']
+    channels = header['channels']
+
+    if sample_width > 4:
+        raise ValueError('Sample size cannot be bigger than 4 bytes.')
+
+    offset = min(max(int(offset), 0), header['frame_count'])
+    frame_count = header['frame_count'] - offset
+    if duration is not None:
+        frame_count = min(int(duration), frame_count)
+
+    if mono:
+        shape = (frame_count,)
+    else:
+        shape = (channels, frame_count)
+
+    if out is None:
+        out = numpy.empty(shape, dtype=numpy.float64)
+    elif out.ndim != len(shape) or out.shape[:-1] != shape[:-1] or out.shape[-1] < frame_count:
+        raise ValueError("Output buffer shape %s does not fit audio shape %s" % (str(out.shape), str(shape)))
+    else:
+        out = out[..., :frame_count]
+
+    if frame_count == 0:
+        return out, header['sample_rate']
+
+    if sample_width == 3:
+        # 24 bit audio, map raw bytes
+        data = numpy.memmap(filename, dtype=numpy.uint8, mode='r',
+                            offset=header['data_offset'] + offset * channels * sample_width,
+                            shape=(frame_count, channels, sample_width))
+    else:
+        # 8 bit samples are stored as unsigned ints; others as signed ints.
+        dt_char = 'u' if sample_width == 1 else 'i'
+        data = numpy.memmap(filename, dtype='<%s%d' % (dt_char, sample_width), mode='r',
+                            offset=header['data_offset'] + offset * channels * sample_width,
+                            shape=(frame_count, channels))
+
+    # Same scaling as used with the wave module based reader
+    scale = float(2 ** (sample_width * 8 - 1) + 1)
+    mix = numpy.empty(min(block_size, frame_count), dtype=numpy.float64)
+    for start in range(0, frame_count, block_size):
+        stop = min(start + block_size, frame_count)
+        block = data[start:stop]
+
+        if sample_width == 3:
+            # Assemble signed 32 bit values, most significant byte carries the sign
+            block = (block[:, :, 0].astype(numpy.int32) |
+                     (block[:, :, 1].astype(numpy.int32) << 8) |
+                     (block[:, :, 2].astype(numpy.int8).astype(numpy.int32) << 16))
+
+        if mono:
+            # Down-mix audio and convert int values into float
+            block_mix = mix[:stop - start]
+            numpy.sum(block, axis=1, dtype=numpy.float64, out=block_mix)
+            block_mix /= channels
+            block_mix /= scale
+            out[start:stop] = block_mix
+        else:
+            out[:, start:stop] = block.T / scale
+
+    del data
+    return out, header['sample_rate']
+
+
 def load_event_list(file):
     data = []
     with open(file, 'rt') as f:
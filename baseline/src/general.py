@@ -1,14 +1,63 @@
 import os
 import hashlib
 import json
+import resource
+import ctypes
 
 def check_path(path):
     if not os.path.isdir(path):
         os.makedirs(path)
 
 
-def get_parameter_hash(params):
+def get_parameter_hash(params, ignore=None):
+    if ignore:
+        params = dict((key, value) for key, value in params.items() if key not in ignore)
+
     md5 = hashlib.md5()
     md5.update(str(json.dumps(params, sort_keys=True)))
     return md5.hexdigest()
 
+
+def get_peak_memory_usage():
+    # Peak resident set size of the current process in bytes (ru_maxrss is reported in kilobytes on Linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def get_loaded_libraries(name):
+    # Paths of the shared libraries loaded into the current process with name in their file name (Linux only)
+    libraries = []
+    if os.path.isfile('/proc/self/maps'):
+        with open('/proc/self/maps', 'rt') as f:
+            for line in f:
+                path = line.split()[-1]
+                if name in os.path.basename(path) and path not in libraries:
+                    libraries.append(path)
+    return libraries
+
+
+def set_blas_threads(thread_count):
+    # Limit the threads used by BLAS in the current process, e.g. in pool workers to avoid oversubscription.
+    # Pool workers are forked with numpy, and its BLAS, already loaded and initialized, so the thread count is set
+    # at runtime in the loaded OpenBLAS and OpenMP libraries, and in MKL. Environment variables cover processes
+    # started later.
+    for variable in ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']:
+        os.environ[variable] = str(thread_count)
+
+    for name, functions in [('openblas', ['openblas_set_num_threads', 'openblas_set_num_threads64_',
+                                          'scipy_openblas_set_num_threads', 'scipy_openblas_set_num_threads64_']),
+                            ('gomp', ['omp_set_num_threads']),
+                            ('iomp', ['omp_set_num_threads'])]:
+        for library_path in get_loaded_libraries(name):
+            try:
+                library = ctypes.CDLL(library_path)
+            except OSError:
+                continue
+            for function in functions:
+                if hasattr(library, function):
+                    getattr(library, function)(ctypes.c_int(thread_count))
+
+    try:
+        import mkl
+        mkl.set_num_threads(thread_count)
+    except ImportError:
+        pass
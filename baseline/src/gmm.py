@@ -0,0 +1,504 @@
+import copy
+import numpy
+
+
+def fold_normalizer_into_gmm(model, normalizer):
+    """Express a GMM trained on normalized features in the raw feature space
+
+    Normalization z = (x - mean) / std is a per-dimension affine map, so the model is moved to the raw space by
+    transforming the means and covariances, spherical models become diagonal. Weights are kept, so log-likelihoods
+    of the folded model on raw features are those of the original model on normalized features minus the constant
+    Jacobian term sum(log(std)). The term is the same for all models folded with the normalizer, and cancels in
+    their likelihood ratios.
+
+    :param model: sklearn.mixture.GMM trained on normalized features
+    :param normalizer: FeatureNormalizer used to normalize the training features
+    :return: new sklearn.mixture.GMM
+    """
+    mean = numpy.ravel(normalizer.mean)
+    std = numpy.ravel(normalizer.std)
+    if numpy.any(std <= 0):
+        raise ValueError("Feature normalizer with zero std cannot be folded into models")
+
+    folded = copy.deepcopy(model)
+    folded.means_ = model.means_ * std + mean
+
+    if model.covariance_type in ['diag', 'spherical']:
+        # Per-dimension scaling makes a spherical covariance diagonal, sklearn stores both as (components, dimension)
+        folded.covariance_type = 'diag'
+        folded.covars_ = model.covars_ * std ** 2
+    elif model.covariance_type == 'full':
+        folded.covars_ = model.covars_ * numpy.outer(std, std)[numpy.newaxis, :, :]
+    elif model.covariance_type == 'tied':
+        folded.covars_ = model.covars_ * numpy.outer(std, std)
+    else:
+        raise ValueError("Covariance type [%s] cannot be folded" % model.covariance_type)
+
+    return folded
+
+
+def fold_normalizer_into_model_container(model_container):
+    """Fold the feature normalizer of the model container into all its models
+
+    Models of the returned container score raw (not normalized) features, marked with 'normalizer_folded'.
+
+    :param model_container: dict with 'normalizer' and 'models'
+    :return: new model container
+    """
+    folded_container = {
+        'normalizer': model_container['normalizer'],
+        'normalizer_folded': True,
+        'models': {},
+    }
+    if 'ubm' in model_container:
+        folded_container['ubm'] = fold_normalizer_into_gmm(model=model_container['ubm'],
+                                                           normalizer=model_container['normalizer'])
+    for label in model_container['models']:
+        folded_container['models'][label] = {}
+        for model_type in model_container['models'][label]:
+            folded_container['models'][label][model_type] = fold_normalizer_into_gmm(model=model_container['models'][label][model_type],
+                                                                                     normalizer=model_container['normalizer'])
+
+    return folded_container
+
+
+def logsumexp(a, axis):
+    a_max = numpy.max(a, axis=axis, keepdims=True)
+    return numpy.log(numpy.sum(numpy.exp(a - a_max), axis=axis)) + numpy.squeeze(a_max, axis=axis)
+
+
+def select_top_components(log_density, shortlist):
+    """Mask of the shortlist components with the highest log-density of each frame and model
+
+    :param log_density: component log-densities, shape (frames, models, components)
+    :param shortlist: number of components selected per frame and model
+    :return: numpy.ndarray of bool, shape (frames, models * components)
+    """
+    frames, models, components = log_density.shape
+    top = numpy.argpartition(log_density, components - shortlist, axis=2)[:, :, components - shortlist:]
+
+    selected = numpy.zeros((frames, models, components), dtype=bool)
+    selected[numpy.arange(frames)[:, numpy.newaxis, numpy.newaxis], numpy.arange(models)[numpy.newaxis, :, numpy.newaxis], top] = True
+    return selected.reshape(frames, -1)
+
+
+def sum_segments(log_likelihood, segment_offsets):
+    # Sums of frame log-likelihoods, shape (frames, models), over consecutive segments of frames starting at
+    # segment_offsets, accumulated in float64. The summation of a segment does not depend on the other segments.
+    return numpy.add.reduceat(numpy.asarray(log_likelihood, dtype=numpy.float64), segment_offsets, axis=0)
+
+
+def score_segments(score_samples, X, segment_offsets):
+    # Total log-likelihoods of consecutive segments of frames starting at segment_offsets, shape (segments, models).
+    # Every segment is scored on its own: its frames are copied out, so that the matrix products see the same
+    # input as for the segment alone, chunked from its first frame and summed in the same order. Totals do not
+    # depend on the other segments of X, clips scored in batches get exactly the scores of clips scored one by one.
+    bounds = numpy.append(segment_offsets, X.shape[0])
+    return numpy.vstack([sum_segments(score_samples(numpy.array(X[start:stop])), [0])
+                         for start, stop in zip(bounds[:-1], bounds[1:])])
+
+
+def gmm_statistics(model, X):
+    """Zeroth and first order sufficient statistics of the feature matrix under the GMM
+
+    :param model: sklearn.mixture.GMM
+    :param X: feature matrix, shape (frames, dimension)
+    :return: zeroth order statistics, shape (components,), first order statistics, shape (components, dimension)
+    """
+    responsibilities = model.score_samples(X)[1]
+    return numpy.sum(responsibilities, axis=0), numpy.dot(responsibilities.T, X)
+
+
+def map_adapt_means(ubm, zeroth, first, relevance_factor=16.0):
+    """MAP adaptation of the GMM means
+
+    Each mean is interpolated between the data mean of the component and the UBM mean, mean = (first + r * ubm_mean) / (zeroth + r).
+    Weights and covariances are kept from the UBM.
+
+    :param ubm: sklearn.mixture.GMM, universal background model
+    :param zeroth: zeroth order statistics of the adaptation data, see gmm_statistics
+    :param first: first order statistics of the adaptation data, see gmm_statistics
+    :param relevance_factor: relevance factor r
+    :return: new sklearn.mixture.GMM
+    """
+    adapted = copy.deepcopy(ubm)
+    adapted.means_ = (first + relevance_factor * ubm.means_) / (zeroth[:, numpy.newaxis] + relevance_factor)
+    return adapted
+
+
+class AdaptedGMMScorer(object):
+    """Scoring of mean adapted GMMs through their shared UBM
+
+    Models sharing the weights and covariances of the UBM differ from it only by the means. The component log-density
+    of an adapted model is the UBM component log-density plus a term linear in the features,
+    delta' P (x - mean) - 0.5 * delta' P delta, with delta the mean shift and P the component precision. The UBM
+    component log-densities are computed once per feature matrix, and the corrections of all models in one matrix product.
+
+    With shortlist k, only the k components with the highest UBM log-density of each frame are evaluated, the
+    other components are left out of the log-sum-exp of every model.
+    """
+
+    def __init__(self, ubm, models, dtype='float64', shortlist=None):
+        """
+        :param ubm: sklearn.mixture.GMM
+        :param models: list of sklearn.mixture.GMM, mean adapted from the ubm
+        :param dtype: data type of the computation
+        :param shortlist: number of components evaluated per frame, None evaluates all
+        """
+        self.ubm = ubm
+        self.dtype = numpy.dtype(dtype)
+        self.ubm_scorer = GMMScorer(models=[ubm], dtype=dtype)
+        self.model_count = len(models)
+        self.shortlist = shortlist if shortlist and shortlist < ubm.means_.shape[0] else None
+
+        components, dimension = ubm.means_.shape
+        linear = numpy.zeros((self.model_count, components, dimension))
+        for model_id, model in enumerate(models):
+            if not numpy.array_equal(model.weights_, ubm.weights_) or not numpy.array_equal(model.covars_, ubm.covars_):
+                raise ValueError("Model is not mean adapted from the UBM")
+
+            delta = model.means_ - ubm.means_
+            if ubm.covariance_type in ['diag', 'spherical']:
+                linear[model_id] = delta / ubm.covars_
+            elif ubm.covariance_type == 'full':
+                for component_id in range(components):
+                    linear[model_id, component_id] = numpy.linalg.solve(ubm.covars_[component_id], delta[component_id])
+            elif ubm.covariance_type == 'tied':
+                linear[model_id] = numpy.linalg.solve(ubm.covars_, delta.T).T
+            else:
+                raise ValueError("Unknown covariance type [%s]" % ubm.covariance_type)
+
+        # Component offsets, -delta' P mean - 0.5 * delta' P delta
+        delta = numpy.array([model.means_ for model in models]) - ubm.means_
+        self.offset = numpy.asarray(-numpy.sum(linear * (ubm.means_ + 0.5 * delta), axis=2).reshape(-1), dtype=self.dtype)
+        self.linear = numpy.asarray(linear.reshape(-1, dimension), dtype=self.dtype)
+
+    def score_samples(self, X):
+        """Log-likelihood of each frame under each model
+
+        :param X: feature matrix, shape (frames, dimension)
+        :return: numpy.ndarray, shape (frames, models)
+        """
+        X = numpy.asarray(X, dtype=self.dtype)
+        ubm_log_density = self.ubm_scorer.component_log_density(X)
+
+        if self.shortlist is None:
+            log_density = numpy.dot(X, self.linear.T) + self.offset
+            log_density = log_density.reshape(X.shape[0], self.model_count, -1)
+        else:
+            # Corrections of the shortlisted components, component by component over the frames selecting it
+            components = ubm_log_density.shape[1]
+            selected = select_top_components(ubm_log_density[:, numpy.newaxis, :], self.shortlist).reshape(X.shape[0], components)
+            linear = self.linear.reshape(self.model_count, components, -1)
+            offset = self.offset.reshape(self.model_count, components)
+            log_density = numpy.empty((X.shape[0], self.model_count, components), dtype=self.dtype)
+            log_density.fill(-numpy.inf)
+            for component_id in range(components):
+                rows = numpy.flatnonzero(selected[:, component_id])
+                if len(rows):
+                    log_density[rows, :, component_id] = numpy.dot(X[rows], linear[:, component_id].T) + offset[:, component_id]
+
+        log_density += ubm_log_density[:, numpy.newaxis, :]
+
+        return logsumexp(log_density, axis=2)
+
+    def score_segments(self, X, segment_offsets):
+        """Total log-likelihood of each segment of the feature matrix under each model, see score_segments
+
+        :param X: feature matrix, shape (frames, dimension)
+        :param segment_offsets: start frames of the segments
+        :return: numpy.ndarray, shape (segments, models)
+        """
+        return score_segments(self.score_samples, X, segment_offsets)
+
+    def score(self, X):
+        """Total log-likelihood of the feature matrix under each model
+
+        :param X: feature matrix, shape (frames, dimension)
+        :return: numpy.ndarray, shape (models,)
+        """
+        return self.score_segments(X, [0])[0]
+
+
+class GMMStatistics(object):
+    """Sufficient statistics of a GMM accumulated over chunks of feature data
+
+    Zeroth, first and second order statistics of the component responsibilities are additive, so chunks can be
+    accumulated in any order and statistics collected in separate processes combined with merge(). update() gives
+    the EM re-estimate of the model, one pass over the data with accumulate() followed by update() is one EM iteration.
+    Second order statistics are accumulated around the weighted mean of the model means, so that features far from
+    zero (e.g. with the normalizer folded into the models) do not lose precision in the covariance re-estimate.
+    """
+
+    def __init__(self, n_components, dimension, covariance_type):
+        self.covariance_type = covariance_type
+        self.frame_count = 0
+        self.log_likelihood = 0.0
+        self.center = None
+        self.zeroth = numpy.zeros(n_components)
+        self.first = numpy.zeros((n_components, dimension))
+        if covariance_type in ['diag', 'spherical']:
+            self.second = numpy.zeros((n_components, dimension))
+        elif covariance_type == 'full':
+            self.second = numpy.zeros((n_components, dimension, dimension))
+        elif covariance_type == 'tied':
+            self.second = numpy.zeros((dimension, dimension))
+        else:
+            raise ValueError("Unknown covariance type [%s]" % covariance_type)
+
+    @classmethod
+    def from_model(cls, model):
+        return cls(n_components=model.means_.shape[0],
+                   dimension=model.means_.shape[1],
+                   covariance_type=model.covariance_type)
+
+    def accumulate(self, model, X):
+        """Accumulate the statistics of the feature matrix under the current model
+
+        :param model: sklearn.mixture.GMM
+        :param X: feature matrix, shape (frames, dimension)
+        :return: nothing
+        """
+        log_likelihood, responsibilities = model.score_samples(X)
+
+        if self.center is None:
+            self.center = numpy.dot(model.weights_, model.means_) / numpy.sum(model.weights_)
+        Y = X - self.center
+
+        self.frame_count += X.shape[0]
+        self.log_likelihood += numpy.sum(log_likelihood)
+        self.zeroth += numpy.sum(responsibilities, axis=0)
+        self.first += numpy.dot(responsibilities.T, X)
+        if self.covariance_type in ['diag', 'spherical']:
+            self.second += numpy.dot(responsibilities.T, Y * Y)
+        elif self.covariance_type == 'full':
+            for component_id in range(self.zeroth.shape[0]):
+                self.second[component_id] += numpy.dot((responsibilities[:, component_id, numpy.newaxis] * Y).T, Y)
+        elif self.covariance_type == 'tied':
+            self.second += numpy.dot(Y.T, Y)
+
+    def merge(self, statistics):
+        # Combine statistics accumulated into another instance, with the same model
+        if statistics.center is None:
+            return
+        if self.center is None:
+            self.center = statistics.center
+        elif not numpy.array_equal(self.center, statistics.center):
+            raise ValueError("Statistics accumulated with different models can not be merged")
+
+        self.frame_count += statistics.frame_count
+        self.log_likelihood += statistics.log_likelihood
+        self.zeroth += statistics.zeroth
+        self.first += statistics.first
+        self.second += statistics.second
+
+    def update(self, model):
+        """EM re-estimate of the model parameters, following sklearn.mixture.GMM
+
+        Only the parameters listed in model.params are updated, covariances are regularized with model.min_covar.
+        Covariances are taken around the updated means, or around the current means when 'm' is not in model.params,
+        like in sklearn.mixture.GMM.
+
+        :param model: sklearn.mixture.GMM used to accumulate the statistics
+        :return: new sklearn.mixture.GMM
+        """
+        eps = numpy.finfo(float).eps
+        updated = copy.deepcopy(model)
+        zeroth = self.zeroth + 10 * eps
+        center = self.center if self.center is not None else numpy.zeros(self.first.shape[1])
+
+        if 'w' in model.params:
+            updated.weights_ = self.zeroth / (numpy.sum(self.zeroth) + 10 * eps) + eps
+        if 'm' in model.params:
+            updated.means_ = self.first / zeroth[:, numpy.newaxis]
+        if 'c' in model.params:
+            dimension = updated.means_.shape[1]
+
+            # First order statistics and means relative to the center of the second order statistics
+            first = self.first - self.zeroth[:, numpy.newaxis] * center
+            shift = updated.means_ - center
+            if self.covariance_type in ['diag', 'spherical']:
+                # sklearn: avg(x^2) - 2 mean avg(x) + mean^2, expressed relative to the center. The mean^2 term is not
+                # weighted by the responsibilities, components without responsibility end up at min_covar.
+                # Clipped at zero against rounding.
+                weight = (self.zeroth / zeroth)[:, numpy.newaxis]
+                covars = numpy.maximum(self.second / zeroth[:, numpy.newaxis]
+                                       - 2 * shift * first / zeroth[:, numpy.newaxis]
+                                       + weight * shift ** 2
+                                       + (1 - weight) * updated.means_ ** 2, 0.0)
+                if self.covariance_type == 'diag':
+                    updated.covars_ = covars + model.min_covar
+                else:
+                    updated.covars_ = numpy.tile(numpy.mean(covars, axis=1)[:, numpy.newaxis] + model.min_covar, (1, dimension))
+            elif self.covariance_type == 'full':
+                # Sum of r (x - mean)(x - mean)' over the frames, divided by the component weight
+                shift_first = shift[:, :, numpy.newaxis] * first[:, numpy.newaxis, :]
+                updated.covars_ = ((self.second - shift_first - shift_first.transpose(0, 2, 1)
+                                    + self.zeroth[:, numpy.newaxis, numpy.newaxis] * shift[:, :, numpy.newaxis] * shift[:, numpy.newaxis, :])
+                                   / zeroth[:, numpy.newaxis, numpy.newaxis]
+                                   + model.min_covar * numpy.eye(dimension))
+            elif self.covariance_type == 'tied':
+                # sklearn: (X'X - means' first) / frames, expressed relative to the center
+                residual = numpy.sum(first, axis=0) - numpy.dot(self.zeroth, shift)
+                updated.covars_ = ((self.second - numpy.dot(shift.T, first) + numpy.outer(residual, center)) / self.frame_count
+                                   + model.min_covar * numpy.eye(dimension))
+
+        return updated
+
+
+class GMMScorer(object):
+    """Vectorized scoring of a set of GMMs
+
+    Components of all models are stacked, and their precision Cholesky factors and log-determinants are computed
+    once. A feature matrix is scored against all models with a few matrix products per chunk of frames: quadratic
+    forms of diagonal covariance components expand into two products over all components, full (and tied)
+    covariance components are whitened with one product against the stacked precision factors. Scores match
+    sklearn.mixture.GMM.score within floating-point tolerance, float32 trades accuracy for speed.
+
+    With shortlist k, the components of full (and tied) covariance models are first ranked per frame with a diagonal
+    covariance approximation (the variances of the full covariances), and only the top k components are evaluated
+    exactly, the other components are left out of the log-sum-exp. Diagonal covariance models are always evaluated
+    exactly, as the ranking pass would cost as much as the exact evaluation.
+    """
+
+    def __init__(self, models, dtype='float64', chunk_size=1024, shortlist=None):
+        """
+        :param models: list of sklearn.mixture.GMM
+        :param dtype: data type of the computation
+        :param chunk_size: number of frames scored at once, bounds the size of the intermediate matrices
+        :param shortlist: number of components evaluated per frame and model of full covariance models, None evaluates all
+        """
+        self.dtype = numpy.dtype(dtype)
+        self.chunk_size = chunk_size
+        self.model_count = len(models)
+
+        dimension = models[0].means_.shape[1]
+        component_counts = [model.means_.shape[0] for model in models]
+        self.model_offsets = numpy.cumsum([0] + component_counts)[:-1]
+
+        diag_components = []
+        full_components = []
+        constant = numpy.zeros(sum(component_counts))
+        for model_id, model in enumerate(models):
+            for component_id in range(model.means_.shape[0]):
+                component_index = self.model_offsets[model_id] + component_id
+                if model.covariance_type in ['diag', 'spherical']:
+                    covars = model.covars_[component_id]
+                    log_det = numpy.sum(numpy.log(covars))
+                    diag_components.append((component_index, model.means_[component_id], 1.0 / covars))
+                elif model.covariance_type in ['full', 'tied']:
+                    covars = model.covars_[component_id] if model.covariance_type == 'full' else model.covars_
+                    try:
+                        covars_chol = numpy.linalg.cholesky(covars)
+                    except numpy.linalg.LinAlgError:
+                        # Regularize like sklearn.mixture.log_multivariate_normal_density
+                        covars_chol = numpy.linalg.cholesky(covars + 1.e-7 * numpy.eye(dimension))
+                    log_det = 2 * numpy.sum(numpy.log(numpy.diagonal(covars_chol)))
+                    precision_chol = numpy.linalg.inv(covars_chol).T
+                    full_components.append((component_index, model.means_[component_id], precision_chol))
+                else:
+                    raise ValueError("Unknown covariance type [%s]" % model.covariance_type)
+
+                constant[component_index] = (numpy.log(model.weights_[component_id])
+                                             - 0.5 * (dimension * numpy.log(2 * numpy.pi) + log_det))
+
+        self.diag_index = numpy.array([component[0] for component in diag_components], dtype=int)
+        if diag_components:
+            means = numpy.array([component[1] for component in diag_components])
+            precisions = numpy.array([component[2] for component in diag_components])
+            self.diag_precisions = numpy.asarray(-0.5 * precisions.T, dtype=self.dtype)
+            self.diag_linear = numpy.asarray((means * precisions).T, dtype=self.dtype)
+            constant[self.diag_index] -= 0.5 * numpy.sum(means ** 2 * precisions, axis=1)
+
+        self.full_index = numpy.array([component[0] for component in full_components], dtype=int)
+        if full_components:
+            # Whitening of component c is x U_c - mean_c U_c, stacked as columns c * dimension:(c + 1) * dimension
+            self.full_precision_chol = numpy.asarray(numpy.hstack([component[2] for component in full_components]), dtype=self.dtype)
+            self.full_offset = numpy.asarray(numpy.hstack([numpy.dot(component[1], component[2]) for component in full_components]), dtype=self.dtype)
+
+        self.dimension = dimension
+        self.constant = numpy.asarray(constant, dtype=self.dtype)
+
+        self.shortlist = None
+        if shortlist and shortlist < max(component_counts) and not diag_components:
+            if len(set(component_counts)) != 1:
+                raise ValueError("Component shortlist needs models with equal number of components")
+            self.shortlist = shortlist
+
+            # Diagonal covariance approximation of all components for the ranking
+            means = numpy.vstack([model.means_ for model in models])
+            variances = numpy.vstack([numpy.diagonal(model.covars_, axis1=1, axis2=2) if model.covariance_type == 'full' else
+                                      numpy.tile(numpy.diagonal(model.covars_), (model.means_.shape[0], 1)) for model in models])
+            log_weights = numpy.hstack([numpy.log(model.weights_) for model in models])
+            self.ranking_precisions = numpy.asarray(-0.5 / variances.T, dtype=self.dtype)
+            self.ranking_linear = numpy.asarray((means / variances).T, dtype=self.dtype)
+            self.ranking_constant = numpy.asarray(log_weights - 0.5 * numpy.sum(numpy.log(variances) + means ** 2 / variances, axis=1),
+                                                  dtype=self.dtype)
+
+    def component_log_density(self, X):
+        # Weighted log-density of all stacked components, shape (frames, components), with shortlist the
+        # components left out have log-density -inf
+        X = numpy.asarray(X, dtype=self.dtype)
+        if self.shortlist is not None:
+            return self.shortlist_log_density(X)
+
+        log_density = numpy.empty((X.shape[0], self.constant.shape[0]), dtype=self.dtype)
+        if len(self.diag_index):
+            log_density[:, self.diag_index] = numpy.dot(X ** 2, self.diag_precisions) + numpy.dot(X, self.diag_linear)
+        if len(self.full_index):
+            whitened = (numpy.dot(X, self.full_precision_chol) - self.full_offset).reshape(X.shape[0], -1, self.dimension)
+            log_density[:, self.full_index] = -0.5 * numpy.sum(whitened ** 2, axis=2)
+        log_density += self.constant
+        return log_density
+
+    def shortlist_log_density(self, X):
+        ranking = numpy.dot(X ** 2, self.ranking_precisions) + numpy.dot(X, self.ranking_linear) + self.ranking_constant
+        selected = select_top_components(ranking.reshape(X.shape[0], self.model_count, -1), self.shortlist)
+
+        log_density = numpy.empty((X.shape[0], self.constant.shape[0]), dtype=self.dtype)
+        log_density.fill(-numpy.inf)
+        for position, component_index in enumerate(self.full_index):
+            # Whiten only the frames selecting the component
+            rows = numpy.flatnonzero(selected[:, component_index])
+            if len(rows):
+                columns = slice(position * self.dimension, (position + 1) * self.dimension)
+                whitened = numpy.dot(X[rows], self.full_precision_chol[:, columns]) - self.full_offset[columns]
+                log_density[rows, component_index] = -0.5 * numpy.sum(whitened ** 2, axis=1)
+        log_density += self.constant
+        log_density[~selected] = -numpy.inf
+        return log_density
+
+    def score_samples(self, X):
+        """Log-likelihood of each frame under each model
+
+        :param X: feature matrix, shape (frames, dimension)
+        :return: numpy.ndarray, shape (frames, models)
+        """
+        log_likelihood = numpy.empty((X.shape[0], self.model_count), dtype=self.dtype)
+        for start in range(0, X.shape[0], self.chunk_size):
+            log_density = self.component_log_density(X[start:start + self.chunk_size])
+
+            # Log-sum-exp over the components of each model
+            log_density_max = numpy.maximum.reduceat(log_density, self.model_offsets, axis=1)
+            log_density -= numpy.repeat(log_density_max, numpy.diff(numpy.append(self.model_offsets, log_density.shape[1])), axis=1)
+            numpy.exp(log_density, out=log_density)
+            log_likelihood[start:start + self.chunk_size] = numpy.log(numpy.add.reduceat(log_density, self.model_offsets, axis=1)) + log_density_max
+
+        return log_likelihood
+
+    def score_segments(self, X, segment_offsets):
+        """Total log-likelihood of each segment of the feature matrix under each model, see score_segments
+
+        :param X: feature matrix, shape (frames, dimension)
+        :param segment_offsets: start frames of the segments
+        :return: numpy.ndarray, shape (segments, models)
+        """
+        return score_segments(self.score_samples, X, segment_offsets)
+
+    def score(self, X):
+        """Total log-likelihood of the feature matrix under each model
+
+        :param X: feature matrix, shape (frames, dimension)
+        :return: numpy.ndarray, shape (models,)
+        """
+        return self.score_segments(X, [0])[0]
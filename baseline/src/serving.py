@@ -0,0 +1,122 @@
+import time
+import threading
+import collections
+import Queue
+import numpy
+
+
+class LatencyMonitor(object):
+    """Latency and batch size statistics of the most recent requests"""
+
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.latencies = collections.deque(maxlen=window)
+        self.batch_sizes = collections.deque(maxlen=window)
+        self.request_count = 0
+        self.batch_count = 0
+
+    def add_latency(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+            self.request_count += 1
+
+    def add_batch(self, batch_size):
+        with self.lock:
+            self.batch_sizes.append(batch_size)
+            self.batch_count += 1
+
+    def percentiles(self, percentiles=(50, 90, 95, 99)):
+        """Latency percentiles in seconds
+
+        :param percentiles: percentiles to compute
+        :return: dict of percentile and latency, empty before the first request
+        """
+        with self.lock:
+            latencies = numpy.array(self.latencies)
+
+        if not len(latencies):
+            return {}
+        return dict(('p' + str(percentile), float(numpy.percentile(latencies, percentile))) for percentile in percentiles)
+
+    def summary(self):
+        with self.lock:
+            batch_sizes = numpy.array(self.batch_sizes)
+
+        return {
+            'requests': self.request_count,
+            'batches': self.batch_count,
+            'mean_batch_size': float(numpy.mean(batch_sizes)) if len(batch_sizes) else 0.0,
+            'latency': self.percentiles(),
+        }
+
+
+class MicroBatcher(object):
+    """Coalesce concurrent requests into batches
+
+    Requests are queued by submit(), which blocks until the result is ready. A worker thread collects requests
+    until max_batch_size requests are queued or max_wait seconds have passed since the first request of the
+    batch, and processes them with one call of process_batch. When a batch fails, its items are processed one by one,
+    and only the failing items get the error.
+    """
+
+    def __init__(self, process_batch, max_batch_size=16, max_wait=0.01, monitor=None):
+        """
+        :param process_batch: function mapping a list of items to a list of results
+        :param max_batch_size: maximum number of items per batch
+        :param max_wait: maximum time in seconds the first item of a batch waits for more items
+        :param monitor: optional LatencyMonitor, batch sizes are recorded into it
+        """
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.monitor = monitor
+        self.queue = Queue.Queue()
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, item):
+        request = {'item': item, 'done': threading.Event(), 'result': None, 'error': None}
+        self.queue.put(request)
+        request['done'].wait()
+
+        if request['error'] is not None:
+            raise request['error']
+        return request['result']
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except Queue.Empty:
+                    break
+
+            if self.monitor is not None:
+                self.monitor.add_batch(len(batch))
+
+            try:
+                self.process(batch)
+            finally:
+                for request in batch:
+                    request['done'].set()
+
+    def process(self, batch):
+        try:
+            results = self.process_batch([request['item'] for request in batch])
+            for request, result in zip(batch, results):
+                request['result'] = result
+        except Exception as error:
+            if len(batch) == 1:
+                batch[0]['error'] = error
+                return
+
+            # Retry item by item, so that only the failing requests get the error
+            for request in batch:
+                self.process([request])
@@ -1,34 +1,72 @@
 import numpy
 
-def event_detection(feature_data, model_container, hop_length_seconds=0.01, smoothing_window_length_seconds=1.0, decision_threshold=0.0, minimum_event_length=0.1, minimum_event_gap=0.1):
+def event_detection(feature_data, model_container, hop_length_seconds=0.01, smoothing_window_length_seconds=1.0, decision_threshold=0.0, minimum_event_length=0.1, minimum_event_gap=0.1, legacy_smoothing=False):
     smoothing_window = int(smoothing_window_length_seconds / hop_length_seconds)
 
-    results = []
-    for event_label in model_container['models']:
-        positive = model_container['models'][event_label]['positive'].score_samples(feature_data)[0]
-        negative = model_container['models'][event_label]['negative'].score_samples(feature_data)[0]
+    event_labels, log_likelihoods = frame_log_likelihoods(feature_data, model_container)
 
-        # Lets keep the system causal and use look-back while smoothing (accumulating) likelihoods
-        for stop_id in range(0, feature_data.shape[0]):
-            start_id = stop_id - smoothing_window
-            if start_id < 0:
-                start_id = 0
-            positive[start_id] = sum(positive[start_id:stop_id])
-            negative[start_id] = sum(negative[start_id:stop_id])
+    # Lets keep the system causal and use look-back while smoothing (accumulating) likelihoods
+    log_likelihoods = moving_sum(log_likelihoods, window_length=smoothing_window, legacy=legacy_smoothing)
 
-        likelihood_ratio = positive - negative
-        event_activity = likelihood_ratio > decision_threshold
+    likelihood_ratios = log_likelihoods[:, 0::2] - log_likelihoods[:, 1::2]
+    event_activity = likelihood_ratios > decision_threshold
 
-        # Find contiguous segments and convert frame-ids into times
-        event_segments = contiguous_regions(event_activity) * hop_length_seconds
+    # Find contiguous segments of all labels and convert frame-ids into times
+    event_segments, event_label_ids = stacked_contiguous_regions(event_activity)
+    event_segments = event_segments * hop_length_seconds
 
-        # Preprocess the event segments
-        event_segments = postrocess_event_segments(event_segments=event_segments, minimum_event_length=minimum_event_length, minimum_event_gap=minimum_event_gap)
+    # Preprocess the event segments
+    event_segments, event_label_ids = postprocess_event_segment_array(event_segments=event_segments,
+                                                                      event_label_ids=event_label_ids,
+                                                                      minimum_event_length=minimum_event_length,
+                                                                      minimum_event_gap=minimum_event_gap)
 
-        for event in event_segments:
-            results.append((event[0], event[1], event_label))
+    return zip(event_segments[:, 0], event_segments[:, 1], [event_labels[label_id] for label_id in event_label_ids])
 
-    return results
+
+def frame_log_likelihoods(feature_data, model_container):
+    # Frame log-likelihoods of all models stacked into one array, positive model before negative model of each
+    # event label. Models are scored at once when the container has a scorer (see add_model_scorer).
+    if model_container.get('scorer', {}).get('scorer') is not None:
+        event_labels = model_container['scorer']['labels']
+        log_likelihoods = model_container['scorer']['scorer'].score_samples(feature_data)
+    else:
+        event_labels = list(model_container['models'])
+        log_likelihoods = numpy.column_stack([model_container['models'][event_label][polarity].score_samples(feature_data)[0]
+                                              for event_label in event_labels for polarity in ['positive', 'negative']])
+
+    return event_labels, log_likelihoods
+
+
+def moving_sum(data, window_length, legacy=False):
+    # Causal moving sum along the frames (first axis), computed from cumulative sums. Frame t gets the sum of
+    # the window_length frames ending at frame t, columns (e.g. likelihoods of all event labels) are independent.
+    #
+    # With legacy, the result of the earlier in-place smoothing loop is reproduced:
+    #   for stop_id in range(0, frame_count):
+    #       start_id = max(stop_id - window_length, 0)
+    #       data[start_id] = sum(data[start_id:stop_id])
+    # which leaves frame t >= 1 with the sum of the window_length frames starting at frame t, the last
+    # window_length frames unchanged, and frame 0 with the sum accumulated over its repeated overwrites.
+    data = numpy.asarray(data, dtype=numpy.float64)
+    frame_count = data.shape[0]
+
+    cumulative = numpy.zeros((frame_count + 1,) + data.shape[1:])
+    numpy.cumsum(data, axis=0, out=cumulative[1:])
+
+    if not legacy:
+        window_start = numpy.maximum(numpy.arange(1, frame_count + 1) - window_length, 0)
+        return cumulative[1:] - cumulative[window_start]
+
+    smoothed = data.copy()
+    if frame_count:
+        if frame_count - window_length > 1:
+            smoothed[1:frame_count - window_length] = cumulative[1 + window_length:frame_count] - cumulative[1:frame_count - window_length]
+
+        overwrite_count = min(window_length, frame_count - 1)
+        smoothed[0] = numpy.sum(cumulative[1:overwrite_count + 1], axis=0) - overwrite_count * cumulative[1]
+
+    return smoothed
 
 
 def contiguous_regions(activity_array):
@@ -50,35 +88,143 @@ def contiguous_regions(activity_array):
     return change_indices.reshape((-1, 2))
 
 
-def postrocess_event_segments(event_segments, minimum_event_length=0.1, minimum_event_gap=0.1):
+def stacked_contiguous_regions(activity_array):
+    # contiguous_regions of all columns of activity_array (frames, labels) at once. Regions are stacked into
+    # one (n, 2) array ordered by label and onset, second return value gives the label id of each region.
+    frame_count, label_count = activity_array.shape
+    padded_activity = numpy.zeros((label_count, frame_count + 2), dtype=numpy.int8)
+    padded_activity[:, 1:-1] = activity_array.T
+
+    # Changes come in onset, offset pairs within each label
+    label_ids, change_indices = numpy.diff(padded_activity, axis=1).nonzero()
+    return change_indices.reshape((-1, 2)), label_ids[0::2]
+
+
+def postprocess_event_segment_array(event_segments, event_label_ids=None, minimum_event_length=0.1, minimum_event_gap=0.1):
+    # postrocess_event_segments for an (n, 2) array of onsets and offsets ordered by onset. With event_label_ids,
+    # the segments of all labels are stacked into one array ordered by label, and events of different labels
+    # are never merged. Returns the (m, 2) array of events, and their label ids when event_label_ids is given.
+    event_segments = numpy.asarray(event_segments).reshape((-1, 2))
+
     # 1. remove short events
-    event_results_1 = []
-    for event in event_segments:
-        if event[1]-event[0] >= minimum_event_length:
-            event_results_1.append((event[0], event[1]))
-
-    if len(event_results_1):
-        # 2. remove small gaps between events
-        event_results_2 = []
-
-        # Load first event into event buffer
-        buffered_event_onset = event_results_1[0][0]
-        buffered_event_offset = event_results_1[0][1]
-        for i in range(1,len(event_results_1)):
-            if event_results_1[i][0] - buffered_event_offset > minimum_event_gap:
-                # The gap between current event and the buffered is bigger than minimum event gap,
-                # store event, and replace buffered event
-                event_results_2.append((buffered_event_onset, buffered_event_offset))
-                buffered_event_onset = event_results_1[i][0]
-                buffered_event_offset = event_results_1[i][1]
-            else:
-                # The gap between current event and the buffered is smalle than minimum event gap,
-                # extend the buffered event until the current offset
-                buffered_event_offset = event_results_1[i][1]
+    keep = event_segments[:, 1] - event_segments[:, 0] >= minimum_event_length
+    event_segments = event_segments[keep]
 
-        # Store last event from buffer
-        event_results_2.append((buffered_event_onset, buffered_event_offset))
+    # 2. remove small gaps between events, an event starts a new group when its gap to the previous event
+    # (of the same label) is bigger than minimum event gap. Groups span from the first onset to the last offset.
+    group_start = numpy.ones(event_segments.shape[0], dtype=bool)
+    group_start[1:] = event_segments[1:, 0] - event_segments[:-1, 1] > minimum_event_gap
+    if event_label_ids is not None:
+        event_label_ids = numpy.asarray(event_label_ids)[keep]
+        group_start[1:] |= event_label_ids[1:] != event_label_ids[:-1]
 
-        return event_results_2
-    else:
-        return event_results_1
+    group_end = numpy.roll(group_start, -1)
+    events = numpy.column_stack((event_segments[group_start, 0], event_segments[group_end, 1]))
+
+    if event_label_ids is not None:
+        return events, event_label_ids[group_start]
+    return events
+
+
+def postrocess_event_segments(event_segments, minimum_event_length=0.1, minimum_event_gap=0.1):
+    # Events as list of (onset, offset) tuples, see postprocess_event_segment_array
+    events = postprocess_event_segment_array(event_segments=event_segments,
+                                             minimum_event_length=minimum_event_length,
+                                             minimum_event_gap=minimum_event_gap)
+    return [(event[0], event[1]) for event in events]
+
+
+class StreamingEventDetector(object):
+    # Event detection of an unbounded stream, feature blocks are processed as they arrive. Gives the events of
+    # event_detection over the whole stream (causal smoothing only, the legacy smoothing looks ahead).
+    #
+    # State carried across blocks is bounded: the last smoothing window of frame log-likelihoods, and per event
+    # label the onset of the open activity region and the buffered event, which a later event closer than
+    # minimum_event_gap would still extend. Events are emitted as soon as they can no longer change.
+    def __init__(self, model_container, hop_length_seconds=0.01, smoothing_window_length_seconds=1.0, decision_threshold=0.0, minimum_event_length=0.1, minimum_event_gap=0.1):
+        self.model_container = model_container
+        self.hop_length_seconds = hop_length_seconds
+        self.smoothing_window = int(smoothing_window_length_seconds / hop_length_seconds)
+        self.decision_threshold = decision_threshold
+        self.minimum_event_length = minimum_event_length
+        self.minimum_event_gap = minimum_event_gap
+        self.reset()
+
+    def reset(self):
+        self.frame_count = 0
+        self.history = None
+        self.open_onsets = {}
+        self.buffered_events = {}
+
+    def process(self, feature_data):
+        # Detect events in the next block of frames, returns list of finalized events (onset, offset, event label)
+        if not feature_data.shape[0]:
+            return []
+
+        event_labels, log_likelihoods = frame_log_likelihoods(feature_data, self.model_container)
+
+        # Smoothing window reaches back into the frames of earlier blocks
+        if self.history is not None:
+            log_likelihoods = numpy.vstack((self.history, log_likelihoods))
+        smoothed = moving_sum(log_likelihoods, window_length=self.smoothing_window)[-feature_data.shape[0]:]
+        self.history = log_likelihoods[max(log_likelihoods.shape[0] - self.smoothing_window + 1, 0):]
+
+        event_activity = (smoothed[:, 0::2] - smoothed[:, 1::2]) > self.decision_threshold
+
+        results = []
+        for label_id, event_label in enumerate(event_labels):
+            results += self.process_activity(event_label, event_activity[:, label_id])
+
+        self.frame_count += feature_data.shape[0]
+        return results
+
+    def process_activity(self, event_label, event_activity):
+        # Activity regions closed in this block, in frames. Region open at the block start continues from its onset.
+        regions = contiguous_regions(event_activity) + self.frame_count
+        open_onset = self.open_onsets.get(event_label)
+        if open_onset is not None:
+            if len(regions) and regions[0][0] == self.frame_count:
+                regions[0][0] = open_onset
+            else:
+                regions = numpy.vstack(([[open_onset, self.frame_count]], regions))
+
+        if event_activity[-1]:
+            self.open_onsets[event_label] = regions[-1][0]
+            regions = regions[:-1]
+        else:
+            self.open_onsets[event_label] = None
+
+        # Earliest onset of any later region, in frames
+        next_onset = self.open_onsets[event_label]
+        if next_onset is None:
+            next_onset = self.frame_count + len(event_activity)
+
+        return self.postprocess(event_label, regions * self.hop_length_seconds, next_onset * self.hop_length_seconds)
+
+    def postprocess(self, event_label, event_segments, next_onset=None):
+        # Short events are removed and small gaps merged together with the buffered event, all but the last
+        # event are final. The last event is final once the next onset is further than minimum_event_gap.
+        event_segments = list(event_segments)
+        if self.buffered_events.get(event_label) is not None:
+            event_segments.insert(0, self.buffered_events[event_label])
+
+        events = postrocess_event_segments(event_segments=event_segments,
+                                           minimum_event_length=self.minimum_event_length,
+                                           minimum_event_gap=self.minimum_event_gap)
+        self.buffered_events[event_label] = None
+        if len(events) and next_onset is not None and next_onset - events[-1][1] <= self.minimum_event_gap:
+            self.buffered_events[event_label] = events.pop()
+
+        return [(event[0], event[1], event_label) for event in events]
+
+    def finalize(self):
+        # End of stream, open regions are closed and the buffered events emitted
+        results = []
+        for event_label in sorted(set(self.open_onsets) | set(self.buffered_events)):
+            event_segments = []
+            if self.open_onsets.get(event_label) is not None:
+                event_segments.append(numpy.array([self.open_onsets[event_label], self.frame_count]) * self.hop_length_seconds)
+            results += self.postprocess(event_label, event_segments)
+
+        self.reset()
+        return results
@@ -0,0 +1,218 @@
+import time
+import numpy
+
+from features import *
+from serving import LatencyMonitor
+
+
+class StreamingFeatureExtractor(object):
+    """Incremental feature extraction of a continuous audio stream
+
+    Samples are pushed in blocks of any size. Samples that do not yet fill a whole analysis frame are carried over
+    to the next block, so frames overlap across block boundaries exactly like in one STFT over the whole stream,
+    and the stream start is reflect padded like a clip start. Differences to the clip-wise FeatureExtractor:
+
+    - the top_db threshold of the log compression is taken from the running maximum of the stream, not from the
+      clip maximum, which is not known before the end of the clip
+    - delta and acceleration coefficients need context frames on both sides. Frames are emitted once their
+      context is complete, i.e. with a delay of the context after the frame, and the first frames of the
+      stream, which lack the context before them, are dropped. All emitted frames are equal to the ones computed over the whole stream.
+    """
+
+    def __init__(self, feature_extractor):
+        """
+        :param feature_extractor: FeatureExtractor defining the features
+        """
+        self.feature_extractor = feature_extractor
+        self.n_fft = feature_extractor.mfcc_params['n_fft']
+        self.hop_length = feature_extractor.mfcc_params['hop_length']
+        self.window = feature_extractor.fft_window()
+
+        # Context frames needed before and after a frame. librosa.feature.delta filters order times with a causal
+        # filter of width taps and shifts the result back by width // 2 frames.
+        self.context_before = 0
+        self.context_after = 0
+        for include, order, delta_params in [(feature_extractor.include_delta, 1, feature_extractor.delta_params),
+                                             (feature_extractor.include_acceleration, 2, feature_extractor.acceleration_params)]:
+            if include:
+                width = delta_params.get('width', 9)
+                self.context_before = max(self.context_before, order * (width - 1) - width // 2)
+                self.context_after = max(self.context_after, width // 2)
+
+        self.reset()
+
+    def reset(self):
+        self.samples = numpy.zeros(0)
+        self.started = False
+        self.running_max = -numpy.inf
+
+        # Static coefficients waiting for their context, shape (coefficients, frames)
+        self.static = numpy.zeros((self.feature_extractor.dct_basis.shape[0], 0))
+
+    @property
+    def delay(self):
+        # Delay of emitted frames in frames, relative to the STFT frames
+        return self.context_after
+
+    def push(self, y):
+        """Extract the frames completed by a block of samples
+
+        :param y: block of audio samples
+        :return: feature matrix of the completed frames, shape (frames, dimension), may have no rows
+        """
+        samples = numpy.concatenate((self.samples, numpy.asarray(y, dtype=numpy.float64) + self.feature_extractor.eps))
+
+        if not self.started:
+            # Reflect padding of the stream start needs n_fft // 2 samples after the first one
+            if len(samples) <= self.n_fft // 2:
+                self.samples = samples
+                return numpy.zeros((0, self.dimension))
+            samples = numpy.concatenate((samples[self.n_fft // 2:0:-1], samples))
+            self.started = True
+
+        frame_count = 0
+        if len(samples) >= self.n_fft:
+            frame_count = 1 + (len(samples) - self.n_fft) // self.hop_length
+
+        # Carry over the samples of the frames not yet complete
+        self.samples = samples[frame_count * self.hop_length:].copy()
+        if not frame_count:
+            return numpy.zeros((0, self.dimension))
+
+        frames = numpy.lib.stride_tricks.as_strided(samples,
+                                                    shape=(frame_count, self.n_fft),
+                                                    strides=(self.hop_length * samples.strides[0], samples.strides[0]))
+        spectrum = numpy.fft.rfft(frames * self.window, axis=-1)
+
+        # Mel projection and log compression, same as in FeatureExtractor
+        mel_spectrum = numpy.dot(spectrum.real ** 2 + spectrum.imag ** 2, self.feature_extractor.mel_basis.T)
+        numpy.maximum(mel_spectrum, self.feature_extractor.amin, out=mel_spectrum)
+        numpy.log10(mel_spectrum, out=mel_spectrum)
+        mel_spectrum *= 10.0
+        self.running_max = max(self.running_max, mel_spectrum.max())
+        numpy.maximum(mel_spectrum, self.running_max - self.feature_extractor.top_db, out=mel_spectrum)
+
+        self.static = numpy.hstack((self.static, numpy.dot(self.feature_extractor.dct_basis, mel_spectrum.T)))
+        return self.collect()
+
+    def collect(self):
+        if not self.context_before and not self.context_after:
+            feature_matrix = self.feature_extractor.collect(self.static, statistics=False)['feat']
+            self.static = self.static[:, :0]
+            return feature_matrix
+
+        # Frames with complete context on both sides. Buffer holds the context frames before the first frame
+        # not yet emitted, except at the stream start, where the first frames without context are dropped.
+        ready = self.static.shape[1] - self.context_before - self.context_after
+        if ready <= 0:
+            return numpy.zeros((0, self.dimension))
+
+        feature_matrix = self.feature_extractor.collect(self.static, statistics=False)['feat']
+        feature_matrix = feature_matrix[self.context_before:self.context_before + ready]
+        self.static = self.static[:, ready:]
+        return feature_matrix
+
+    @property
+    def dimension(self):
+        static_count = self.feature_extractor.dct_basis.shape[0]
+        dimension = static_count * (1 + int(bool(self.feature_extractor.include_delta)) + int(bool(self.feature_extractor.include_acceleration)))
+        if not self.feature_extractor.include_mfcc0:
+            dimension -= 1
+        return dimension
+
+
+class StreamingTagger(object):
+    """Tagging of a continuous audio stream over a sliding window
+
+    Frame log-likelihoods of all models are kept in a ring buffer of the window length, and their running sums
+    give the likelihood ratios of the window. Memory use is constant over the stream.
+    """
+
+    def __init__(self, feature_extractor, scorer, labels, normalizer=None, window_seconds=4.0, hop_seconds=1.0, frame_seconds=0.01):
+        """
+        :param feature_extractor: FeatureExtractor defining the features
+        :param scorer: scorer of the models, score_samples(X) gives the frame log-likelihoods, shape (frames, models)
+        :param labels: list of tags, scorer models are ordered by tag, positive model before negative model
+        :param normalizer: optional FeatureNormalizer applied before scoring
+        :param window_seconds: length of the scored window in seconds
+        :param hop_seconds: hop between scored windows in seconds
+        :param frame_seconds: hop between feature frames in seconds
+        """
+        self.stream = StreamingFeatureExtractor(feature_extractor)
+        self.scorer = scorer
+        self.normalizer = normalizer
+        self.frame_seconds = frame_seconds
+        self.window_frames = max(1, int(round(window_seconds / frame_seconds)))
+        self.hop_frames = max(1, int(round(hop_seconds / frame_seconds)))
+
+        self.labels = list(labels)
+
+        self.monitor = LatencyMonitor()
+        self.log_likelihoods = numpy.zeros((self.window_frames, 2 * len(self.labels)))
+        self.reset()
+
+    def reset(self):
+        self.stream.reset()
+        self.log_likelihoods[:] = 0.0
+        self.running_sum = numpy.zeros(self.log_likelihoods.shape[1])
+        self.position = 0
+        self.frame_count = 0
+
+    def push(self, y):
+        """Tag the windows completed by a block of samples
+
+        :param y: block of audio samples
+        :return: list of window results, dicts with window start and end in seconds and the likelihood ratios
+        """
+        start_time = time.time()
+
+        feature_matrix = self.stream.push(y)
+        results = []
+        if feature_matrix.shape[0]:
+            if self.normalizer is not None:
+                feature_matrix = self.normalizer.normalize(feature_matrix)
+            log_likelihood = self.scorer.score_samples(feature_matrix)
+
+            start = 0
+            while start < log_likelihood.shape[0]:
+                remaining = self.frames_to_next_window()
+                stop = min(log_likelihood.shape[0], start + remaining, start + self.window_frames)
+                self.add(log_likelihood[start:stop])
+                if stop - start == remaining:
+                    results.append(self.result())
+                start = stop
+
+        self.monitor.add_latency(time.time() - start_time)
+        return results
+
+    def frames_to_next_window(self):
+        if self.frame_count < self.window_frames:
+            return self.window_frames - self.frame_count
+        return self.hop_frames - (self.frame_count - self.window_frames) % self.hop_frames
+
+    def add(self, log_likelihood):
+        # Write at most window_frames frames into the ring buffer, frames leaving the window are removed from the
+        # running sums. The ring buffer is zero until the window is filled.
+        for frames in numpy.array_split(log_likelihood, [self.window_frames - self.position]):
+            if not frames.shape[0]:
+                continue
+            ring = self.log_likelihoods[self.position:self.position + frames.shape[0]]
+            self.running_sum -= ring.sum(axis=0)
+            ring[:] = frames
+            self.running_sum += frames.sum(axis=0)
+
+            self.position = (self.position + frames.shape[0]) % self.window_frames
+            self.frame_count += frames.shape[0]
+            if self.position == 0 and self.frame_count >= self.window_frames:
+                # Resynchronize the running sums once per window, so that rounding errors do not accumulate
+                self.running_sum = self.log_likelihoods.sum(axis=0)
+
+    def result(self):
+        # Window times are stream times, the feature delay is taken into account
+        end = (self.frame_count + self.stream.delay) * self.frame_seconds
+        likelihood_ratios = self.running_sum[0::2] - self.running_sum[1::2]
+        return {
+            'start': end - self.window_frames * self.frame_seconds,
+            'end': end,
+            'likelihood_ratios': dict(zip(self.labels, likelihood_ratios.tolist())),
+        }
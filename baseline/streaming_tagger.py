@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# DCASE 2016::Domestic Audio Tagging / Baseline System
+# Streaming tagger, continuous audio tagged over a sliding window
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from src.ui import *
+from src.general import *
+from src.files import *
+from src.features import *
+from src.streaming import *
+
+import os
+import sys
+import numpy
+import argparse
+import textwrap
+
+from tagging_server import Tagger, get_served_model
+
+
+def read_blocks(audio_filename, fs, block_length):
+    # Blocks of audio samples. Wav files are read block by block with partial reads, '-' reads 16-bit mono PCM
+    # at the sampling rate of the system from the standard input as it arrives. Samples are scaled like in
+    # load_wav, so both inputs give the same features.
+    scale = float(2 ** 15 + 1)
+    if audio_filename == '-':
+        while True:
+            data = sys.stdin.read(2 * block_length)
+            if not data:
+                break
+            yield numpy.frombuffer(data[:len(data) // 2 * 2], dtype='<i2') / scale
+    else:
+        if os.path.splitext(audio_filename)[1] != '.wav':
+            raise ValueError("Only wav files can be streamed, pipe other formats as PCM to the standard input [%s]" % audio_filename)
+
+        header = read_wav_header(audio_filename)
+        if header['sample_rate'] != fs:
+            raise ValueError("Sampling rate [%d] of the file differs from the sampling rate [%d] of the system [%s]" % (
+                header['sample_rate'], fs, audio_filename))
+
+        for start in range(0, header['frame_count'], block_length):
+            yield load_audio(filename=audio_filename, mono=True, fs=fs, offset=start, duration=block_length)[0]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''\
+            DCASE 2016
+            Task: Domestic Audio Tagging
+            Baseline System streaming tagger
+            ---------------------------------------------
+                Tags continuous audio with the trained models of one fold,
+                over a sliding window defined in task4_audio_tagging.yaml.
+                Audio is pushed in blocks, and the latency of each block
+                is measured.
+        '''))
+    parser.add_argument("audio", help="Audio file, or - for 16-bit mono PCM from the standard input")
+    parser.add_argument("-development", help="Use the models of the development mode", action='store_true',
+                        default=False, dest='development')
+    parser.add_argument("-challenge", help="Use the models of the challenge mode (default)", action='store_true',
+                        default=False, dest='challenge')
+    parser.add_argument("-fold", help="Fold of the models, 0 in the challenge mode", type=int,
+                        default=None, dest='fold')
+    args = parser.parse_args()
+
+    params, model_filename = get_served_model(development=args.development and not args.challenge, fold=args.fold)
+
+    title("DCASE 2016::Domestic Audio Tagging / Streaming tagger")
+
+    # Frames are scored one block at a time, which only the native scorers do
+    tagger = Tagger(model_filename=model_filename,
+                    feature_params=params['features'],
+                    classifier_params=dict(params['classifier'], scoring='native'))
+    model_container = tagger.model_container
+
+    streaming_tagger = StreamingTagger(feature_extractor=tagger.feature_extractor,
+                                       scorer=model_container['scorer']['scorer'],
+                                       labels=model_container['scorer']['labels'],
+                                       normalizer=None if model_container.get('normalizer_folded') else model_container['normalizer'],
+                                       window_seconds=params['streaming']['window_seconds'],
+                                       hop_seconds=params['streaming']['hop_seconds'],
+                                       frame_seconds=params['features']['hop_length_seconds'])
+
+    block_length = int(params['streaming']['block_seconds'] * params['features']['fs'])
+    block_count = 0
+    for y in read_blocks(args.audio, fs=params['features']['fs'], block_length=block_length):
+        for result in streaming_tagger.push(y):
+            tags = ' '.join('%s:%+.1f' % (tag, result['likelihood_ratios'][tag]) for tag in streaming_tagger.labels)
+            print "  [%8.2f - %8.2f s] %s" % (result['start'], result['end'], tags)
+        block_count += 1
+
+    section_header('Block latency')
+    latency = streaming_tagger.monitor.percentiles()
+    print "  Blocks [%d], block length [%.3f s]" % (block_count, params['streaming']['block_seconds'])
+    for percentile in sorted(latency, key=lambda key: int(key[1:])):
+        print "  %-4s %8.2f ms  (real-time factor %.3f)" % (percentile, latency[percentile] * 1000,
+                                                          latency[percentile] / params['streaming']['block_seconds'])
+
+    foot()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
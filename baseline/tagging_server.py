@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# DCASE 2016::Domestic Audio Tagging / Baseline System
+# Tagging server, trained models served over a local HTTP interface
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from src.ui import *
+from src.general import *
+from src.files import *
+from src.features import *
+from src.serving import *
+
+import os
+import sys
+import time
+import json
+import numpy
+import argparse
+import textwrap
+import tempfile
+import urlparse
+import SocketServer
+import BaseHTTPServer
+
+from task4_audio_tagging import process_parameters, get_model_filename, add_model_scorer, binary_classifier_batch
+
+
+class Tagger(object):
+    """Model container of one fold with the feature extraction of the system, clips are tagged in batches"""
+
+    def __init__(self, model_filename, feature_params, classifier_params):
+        self.model_container = add_model_scorer(model_container=load_data(model_filename),
+                                                scoring=classifier_params['scoring'],
+                                                dtype=classifier_params['scoring_dtype'],
+                                                shortlist=classifier_params['scoring_shortlist'])
+        self.feature_extractor = FeatureExtractor.from_params(feature_params)
+        self.fs = feature_params['fs']
+
+    def load(self, audio_filename):
+        return load_audio(filename=audio_filename, mono=True, fs=self.fs)[0]
+
+    def tag(self, y_list):
+        """Likelihood ratios of the audio tags
+
+        :param y_list: list of audio signals
+        :return: list of dicts of tag and likelihood ratio, in order of y_list
+        """
+        feature_matrices = [feature_data['feat'] for feature_data in self.feature_extractor.extract_batch(y_list, statistics=False)]
+
+        # Normalize features into one matrix, unless the normalizer is folded into the models
+        normalizer = None if self.model_container.get('normalizer_folded') else self.model_container['normalizer']
+        frame_buffer = FrameBuffer(frame_count=sum(feature_matrix.shape[0] for feature_matrix in feature_matrices),
+                                   dimension=feature_matrices[0].shape[1])
+        for feature_matrix in feature_matrices:
+            frame_buffer.append(feature_matrix, normalizer=normalizer)
+        feature_data, clip_offsets = frame_buffer.finalize()
+
+        return binary_classifier_batch(feature_data=feature_data,
+                                       clip_offsets=clip_offsets,
+                                       model_container=self.model_container)
+
+
+class TaggingRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # POST /tag?file=<path> tags a local audio file, POST /tag with the audio file as body tags the
+    # uploaded file (format from the X-Audio-Format header, wav by default). GET /stats gives request statistics.
+
+    def do_POST(self):
+        start_time = time.time()
+        url = urlparse.urlparse(self.path)
+        if url.path != '/tag':
+            self.send_json(404, {'error': 'Unknown path [%s]' % url.path})
+            return
+
+        try:
+            query = urlparse.parse_qs(url.query)
+            if 'file' in query:
+                y = self.server.tagger.load(query['file'][0])
+            else:
+                # Uploaded audio goes through a temporary file, audio loading reads files
+                audio_format = self.headers.get('X-Audio-Format', 'wav')
+                with tempfile.NamedTemporaryFile(suffix='.' + audio_format) as f:
+                    f.write(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                    f.flush()
+                    y = self.server.tagger.load(f.name)
+
+            likelihood_ratios = self.server.batcher.submit(y)
+
+        except Exception as error:
+            self.send_json(400, {'error': str(error)})
+            return
+
+        latency = time.time() - start_time
+        self.server.monitor.add_latency(latency)
+        self.send_json(200, {'likelihood_ratios': likelihood_ratios, 'latency': latency})
+
+    def do_GET(self):
+        if urlparse.urlparse(self.path).path != '/stats':
+            self.send_json(404, {'error': 'Unknown path [%s]' % self.path})
+            return
+
+        self.send_json(200, self.server.monitor.summary())
+
+    def send_json(self, code, data):
+        body = json.dumps(data)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        if isinstance(self.client_address, tuple):
+            return BaseHTTPServer.BaseHTTPRequestHandler.address_string(self)
+        return 'unix'
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TaggingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class TaggingUnixHTTPServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+def get_served_model(development=False, fold=None):
+    # Parameters from the config file, and the model file of the served fold
+    params = load_parameters('task4_audio_tagging.yaml')
+
+    if development:
+        dataset_class_name = params['general']['development_dataset']
+        fold = fold if fold is not None else 1
+    else:
+        dataset_class_name = params['general']['challenge_dataset']
+        fold = fold if fold is not None else 0
+
+    params = process_parameters(params, dataset_class_name)
+
+    model_filename = get_model_filename(fold=fold, path=params['path']['models'])
+    if not os.path.isfile(model_filename):
+        raise IOError("Model file not found [%s]" % model_filename)
+
+    return params, model_filename
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=textwrap.dedent('''\
+            DCASE 2016
+            Task: Domestic Audio Tagging
+            Baseline System tagging server
+            ---------------------------------------------
+                Serves the trained models of one fold over HTTP on localhost
+                or on a Unix socket, with the parameters defined in
+                task4_audio_tagging.yaml. Concurrent requests are tagged
+                in batches.
+        '''))
+    parser.add_argument("-development", help="Serve the models of the development mode", action='store_true',
+                        default=False, dest='development')
+    parser.add_argument("-challenge", help="Serve the models of the challenge mode (default)", action='store_true',
+                        default=False, dest='challenge')
+    parser.add_argument("-fold", help="Fold of the served models, 0 in the challenge mode", type=int,
+                        default=None, dest='fold')
+    args = parser.parse_args()
+
+    params, model_filename = get_served_model(development=args.development and not args.challenge, fold=args.fold)
+
+    title("DCASE 2016::Domestic Audio Tagging / Tagging server")
+
+    tagger = Tagger(model_filename=model_filename,
+                    feature_params=params['features'],
+                    classifier_params=params['classifier'])
+    monitor = LatencyMonitor()
+    batcher = MicroBatcher(process_batch=tagger.tag,
+                           max_batch_size=params['server']['max_batch_size'],
+                           max_wait=params['server']['max_wait_seconds'],
+                           monitor=monitor)
+
+    if params['server']['socket']:
+        if os.path.exists(params['server']['socket']):
+            os.remove(params['server']['socket'])
+        server = TaggingUnixHTTPServer(params['server']['socket'], TaggingRequestHandler)
+        print "  Serving [%s] on unix socket [%s]" % (model_filename, params['server']['socket'])
+    else:
+        server = TaggingHTTPServer((params['server']['host'], params['server']['port']), TaggingRequestHandler)
+        print "  Serving [%s] on [http://%s:%d]" % (model_filename, params['server']['host'], params['server']['port'])
+
+    server.tagger = tagger
+    server.batcher = batcher
+    server.monitor = monitor
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    foot()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
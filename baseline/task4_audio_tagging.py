@@ -21,6 +21,9 @@
 from src.ui import *
 from src.general import *
 from src.features import *
+from src.feature_store import *
+from src.feature_cache import *
+from src.gmm import *
 from src.dataset import *
 from src.dataset_chimehome import *
 from src.evaluation import *
@@ -34,6 +37,9 @@ import warnings
 import argparse
 import textwrap
 import math
+import copy
+import time
+import multiprocessing
 import librosa
 
 import pdb
@@ -72,6 +78,9 @@ def main(argv):
     parser.add_argument("-challenge", help="Use the system in the challenge mode", action='store_true',
                         default=False, dest='challenge')
 
+    parser.add_argument("-evict_features", help="Evict least recently used features until the feature cache fits into given size (MB)",
+                        type=float, default=None, dest='evict_features', metavar='MB')
+
     parser.add_argument('-v', '--version', action='version', version='%(prog)s ' + __version__)
     args = parser.parse_args()
 
@@ -80,6 +89,16 @@ def main(argv):
 
     title("DCASE 2016::Domestic Audio Tagging / Baseline System")
 
+    if args.evict_features is not None:
+        section_header('Feature cache eviction')
+        feature_cache = FeatureCache(path=os.path.join(params['path']['base'], params['path']['features']))
+        removed_count, removed_size, cache_size = feature_cache.evict(max_size=args.evict_features * 1024 ** 2)
+        print "  Removed {:d} feature files [{:.1f} MB], cache size {:.1f} MB".format(removed_count,
+                                                                                   removed_size / float(1024 ** 2),
+                                                                                   cache_size / float(1024 ** 2))
+        foot()
+        return
+
     # Check if mode is defined
     if not (args.development or args.challenge):
         args.development = True
@@ -99,6 +118,9 @@ def main(argv):
 
     params = process_parameters(params, dataset.__class__.__name__)        
 
+    # Features are cached by audio content, shared by all datasets and modes
+    feature_cache = FeatureCache(path=params['path']['feature_cache'])
+
     # Fetch data over internet and setup the data
     # ==================================================
     if params['flow']['initialize']:
@@ -121,13 +143,23 @@ def main(argv):
                     files.append(item['file'])
         files = sorted(files)
 
-        # Go through files and make sure all features are extracted
+        # Go through files and make sure all features, and the feature variants, are extracted
+        feature_paths = [params['path']['features']] + [variant['path'] for variant in params['feature_variants']]
         do_feature_extraction(files=files,
                               dataset=dataset,
-                              feature_path=params['path']['features'],
-                              params=params['features'],
+                              feature_cache=feature_cache,
+                              feature_path=feature_paths,
+                              params=[params['features']] + [variant['params'] for variant in params['feature_variants']],
                               overwrite=params['general']['overwrite'])
 
+        if params['features']['store']:
+            # Consolidate extracted features into the feature store
+            for feature_path in feature_paths:
+                do_feature_store(files=files,
+                                 feature_cache=feature_cache,
+                                 feature_path=feature_path,
+                                 overwrite=params['general']['overwrite'])
+
         foot()
 
     # Prepare feature normalizers
@@ -136,9 +168,11 @@ def main(argv):
         section_header('Feature normalizer')
 
         do_feature_normalization(dataset=dataset,
+                                 feature_cache=feature_cache,
                                  dataset_evaluation_mode=dataset_evaluation_mode,
                                  feature_normalizer_path=params['path']['feature_normalizers'],
                                  feature_path=params['path']['features'],
+                                 single_pass=params['feature_normalizer']['single_pass'],
                                  overwrite=params['general']['overwrite'])
 
         foot()
@@ -149,6 +183,7 @@ def main(argv):
         section_header('System training')
 
         do_system_training(dataset=dataset,
+                           feature_cache=feature_cache,
                            dataset_evaluation_mode=dataset_evaluation_mode,
                            model_path=params['path']['models'],
                            feature_normalizer_path=params['path']['feature_normalizers'],
@@ -156,6 +191,14 @@ def main(argv):
                            hop_length_seconds=params['features']['hop_length_seconds'],
                            classifier_params=params['classifier']['parameters'],
                            classifier_method=params['classifier']['method'],
+                           training_data_dtype=params['classifier']['training_data_dtype'],
+                           fold_normalizer=params['classifier']['fold_normalizer'],
+                           max_training_frames=params['classifier']['max_training_frames'],
+                           streaming=params['classifier']['streaming'],
+                           streaming_init_frames=params['classifier']['streaming_init_frames'],
+                           streaming_chunk_frames=params['classifier']['streaming_chunk_frames'],
+                           workers=params['classifier']['workers'],
+                           blas_threads=params['classifier']['blas_threads'],
                            overwrite=params['general']['overwrite']
                            )
 
@@ -167,13 +210,21 @@ def main(argv):
     if params['flow']['test_system']:
         section_header('System testing     [Development data]')
 
+        if params['classifier']['scoring_shortlist'] and not params['classifier']['scoring_shortlist_applied']:
+            print "  Scoring shortlist [%d] does not apply to these models, models are scored exactly" % params['classifier']['scoring_shortlist']
+
         do_system_testing(dataset=dataset,
+                            feature_cache=feature_cache,
                             dataset_evaluation_mode=dataset_evaluation_mode,
                             result_path=params['path']['results'],
                             model_path=params['path']['models'],
                             feature_path=params['path']['features'],
                             feature_params=params['features'],
                             classifier_method=params['classifier']['method'],
+                            scoring=params['classifier']['scoring'],
+                            scoring_dtype=params['classifier']['scoring_dtype'],
+                            shortlist=params['classifier']['scoring_shortlist'] if params['classifier']['scoring_shortlist_applied'] else None,
+                            batch_size=params['classifier']['test_batch_size'],
                             overwrite=params['general']['overwrite']
                             )
         foot()
@@ -186,7 +237,8 @@ def main(argv):
     
             do_system_evaluation(dataset=dataset,
                                     dataset_evaluation_mode=dataset_evaluation_mode,
-                                    result_path=params['path']['results'])
+                                    result_path=params['path']['results'],
+                                    reference=params['classifier']['scoring_shortlist_applied'])
     
             foot()
 
@@ -198,13 +250,47 @@ def process_parameters(params, dataset):
     # Copy parameters for current classifier method
     params['classifier']['parameters'] = params['classifier_parameters'][params['classifier']['method']]
 
-    params['features']['hash'] = get_parameter_hash(params['features'])
-    params['classifier']['hash'] = get_parameter_hash(params['classifier'])
+    # Runtime settings do not change the features, leave them out of the hash
+    params['features']['hash'] = get_parameter_hash(params['features'], ignore=['workers', 'batch_size', 'store', 'variants'])
+    params['classifier']['hash'] = get_parameter_hash(params['classifier'], ignore=['workers', 'blas_threads', 'streaming_chunk_frames',
+                                                                                     'scoring', 'scoring_dtype', 'scoring_shortlist', 'test_batch_size'])
+
+    # Scoring settings change the results but not the models, results are stored per scoring
+    params['classifier']['scoring_hash'] = get_parameter_hash(dict((key, params['classifier'][key]) for key in ['scoring', 'scoring_dtype', 'scoring_shortlist']))
+
+    # Shortlist is applied by the native scorers only, with fewer shortlisted than model components, and to
+    # adapted or full covariance models; diagonal covariance models are scored exactly by GMMScorer
+    shortlist = params['classifier']['scoring_shortlist']
+    params['classifier']['scoring_shortlist_applied'] = bool(
+        params['classifier']['scoring'] == 'native' and shortlist
+        and shortlist < params['classifier']['parameters']['n_components']
+        and (params['classifier']['method'] == 'gmm_ubm' or params['classifier']['parameters']['covariance_type'] in ['full', 'tied']))
 
+    params['path']['feature_cache'] = os.path.join(params['path']['base'], params['path']['features'])
     params['path']['features'] = os.path.join(params['path']['base'], params['path']['features'], params['features']['hash'])
+
+    # Feature variants, overrides of the feature parameters extracted in the same pass as the features,
+    # stored under their own hash like the features of a system run with those parameters
+    params['feature_variants'] = []
+    for overrides in params['features'].get('variants') or []:
+        variant = copy.deepcopy(dict((key, value) for key, value in params['features'].items() if key not in ['variants', 'hash']))
+        for key, value in overrides.items():
+            if isinstance(value, dict):
+                variant[key] = dict(variant.get(key) or {}, **value)
+            else:
+                variant[key] = value
+        variant['mfcc']['win_length'] = int(variant['win_length_seconds'] * variant['fs'])
+        variant['mfcc']['hop_length'] = int(variant['hop_length_seconds'] * variant['fs'])
+        variant['hash'] = get_parameter_hash(variant, ignore=['workers', 'batch_size', 'store', 'variants'])
+        params['feature_variants'].append({
+            'params': variant,
+            'path': os.path.join(params['path']['feature_cache'], variant['hash']),
+        })
+
     params['path']['feature_normalizers'] = os.path.join(params['path']['base'], params['path']['feature_normalizers'], dataset, params['features']['hash'])
     params['path']['models'] = os.path.join(params['path']['base'], params['path']['models'], dataset, params['features']['hash'], params['classifier']['hash'])
-    params['path']['results'] = os.path.join(params['path']['base'], params['path']['results'], dataset, params['features']['hash'], params['classifier']['hash'])
+    params['path']['results'] = os.path.join(params['path']['base'], params['path']['results'], dataset, params['features']['hash'], params['classifier']['hash'],
+                                             params['classifier']['scoring_hash'])
     return params
 
 
@@ -223,215 +309,991 @@ def get_result_filename(fold, path, extension='txt'):
     return os.path.join(path, 'results_fold' + str(fold) + '.' + extension)
 
 
-def do_feature_extraction(files, dataset, feature_path, params, overwrite=False):
-    # Check that target path exists, create if not
-    check_path(feature_path)
+def get_reference_result_filename(fold, path, extension='txt'):
+    # Results of exact scoring, stored next to the results of approximate scoring
+    return os.path.join(path, 'results_fold' + str(fold) + '_exact.' + extension)
 
-    for file_id, audio_filename in enumerate(files):
-        # Get feature filename
-        current_feature_file = get_feature_filename(audio_file=os.path.split(audio_filename)[1], path=feature_path)
 
-        progress(title='Extracting [sequences]',
+def do_feature_extraction(files, dataset, feature_cache, feature_path, params, overwrite=False):
+    # Several feature configurations (the features and their variants) can be extracted in one pass by giving
+    # params and feature_path as lists, configurations sharing the STFT parameters share the power spectrogram
+    if isinstance(params, dict):
+        params = [params]
+        feature_path = [feature_path]
+
+    # Check that target paths exist, create if not
+    for current_feature_path in feature_path:
+        check_path(current_feature_path)
+
+    workers = params[0].get('workers', 1) or 1
+    pool = multiprocessing.Pool(processes=workers) if workers > 1 else None
+    try:
+        # Audio digests missing from the index are computed in the pool
+        for audio_filename in files:
+            if not os.path.isfile(dataset.relative_to_absolute_path(audio_filename)):
+                raise IOError("Audio file not found [%s]" % audio_filename)
+        index_audio_digests(audio_filenames=[dataset.relative_to_absolute_path(audio_filename) for audio_filename in files],
+                            feature_cache=feature_cache,
+                            pool=pool)
+
+        extract_features(files=files, dataset=dataset, feature_cache=feature_cache, feature_path=feature_path,
+                         params=params, pool=pool, overwrite=overwrite)
+
+        if pool is not None:
+            pool.close()
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.join()
+
+
+def index_audio_digests(audio_filenames, feature_cache, pool=None):
+    # Hash the audio files not in the digest index (or changed since), the index is checked first by file size and
+    # modification time so warm runs read no audio
+    missing_filenames = sorted(set(audio_filename for audio_filename in audio_filenames
+                                   if feature_cache.cached_digest(audio_filename) is None))
+    if not missing_filenames:
+        return
+
+    if pool is not None:
+        items = pool.imap(get_digest_item, missing_filenames, chunksize=16)
+    else:
+        items = (get_digest_item(audio_filename) for audio_filename in missing_filenames)
+
+    for file_id, (audio_filename, item) in enumerate(zip(missing_filenames, items)):
+        progress(title='Hashing [sequences]',
+                 percentage=(float(file_id) / len(missing_filenames)),
+                 note=os.path.split(audio_filename)[1])
+        feature_cache.add(audio_filename, item)
+
+    feature_cache.save()
+
+
+def extract_features(files, dataset, feature_cache, feature_path, params, pool=None, overwrite=False):
+    # Collect files which still need to be extracted, completed files and files with already collected audio content are skipped
+    jobs = []
+    pending_feature_files = set()
+    for file_id, audio_filename in enumerate(files):
+        progress(title='Indexing [sequences]',
                  percentage=(float(file_id) / len(files)),
                  note=os.path.split(audio_filename)[1])
 
-        if not os.path.isfile(current_feature_file) or overwrite:
-            # Load audio
-            if os.path.isfile(dataset.relative_to_absolute_path(audio_filename)):
-                y, fs = load_audio(filename=dataset.relative_to_absolute_path(audio_filename), mono=True, fs=params['fs'])
-            else:
-                raise IOError("Audio file not found [%s]" % audio_filename)
+        feature_files = {}
+        for variant_id, current_feature_path in enumerate(feature_path):
+            # Get feature filename
+            current_feature_file = get_feature_filename(audio_file=feature_cache.digest(dataset.relative_to_absolute_path(audio_filename)),
+                                                        path=current_feature_path)
+
+            if (not os.path.isfile(current_feature_file) or overwrite) and current_feature_file not in pending_feature_files:
+                feature_files[variant_id] = current_feature_file
+                pending_feature_files.add(current_feature_file)
+
+        if feature_files:
+            jobs.append((dataset.relative_to_absolute_path(audio_filename), feature_files))
+
+    feature_cache.save()
+
+    # Group files into batches, equal length clips inside a batch are transformed together
+    batch_size = params[0].get('batch_size', 1) or 1
+    batches = [(jobs[batch_start:batch_start + batch_size], params) for batch_start in range(0, len(jobs), batch_size)]
+
+    if pool is not None and len(batches) > 1:
+        # Fan batches out to the process pool, results are collected in completion order
+        extracted_count = 0
+        for audio_filenames in pool.imap_unordered(extract_feature_files, batches):
+            extracted_count += len(audio_filenames)
+            progress(title='Extracting [sequences]',
+                     percentage=(float(extracted_count) / len(jobs)),
+                     note=os.path.split(audio_filenames[-1])[1])
+    else:
+        for batch_id, batch in enumerate(batches):
+            progress(title='Extracting [sequences]',
+                     percentage=(float(batch_id * batch_size) / len(jobs)),
+                     note=os.path.split(batch[0][0][0])[1])
+
+            extract_feature_files(batch)
+
+
+def extract_feature_files(batch):
+    jobs, params = batch
+
+    # Group feature configurations by STFT parameters
+    feature_extractors = [get_feature_extractor(variant_params) for variant_params in params]
+    variant_groups = {}
+    for variant_id, feature_extractor in enumerate(feature_extractors):
+        variant_groups.setdefault(feature_extractor.stft_params, []).append(variant_id)
+
+    audio = {}
+    for stft_params, variant_ids in variant_groups.items():
+        # Files missing at least one of the variants in the group
+        group_jobs = [job for job in jobs if set(job[1]).intersection(variant_ids)]
+        if not group_jobs:
+            continue
+
+        # Load audio, once per file and sampling rate
+        fs = params[variant_ids[0]]['fs']
+        y_list = []
+        for audio_filename, feature_files in group_jobs:
+            if (audio_filename, fs) not in audio:
+                audio[(audio_filename, fs)] = load_audio(filename=audio_filename, mono=True, fs=fs)[0]
+            y_list.append(audio[(audio_filename, fs)])
+
+        # Extract features
+        group_feature_extractors = [feature_extractors[variant_id] for variant_id in variant_ids]
+        if len(y_list) == 1 and len(group_feature_extractors) == 1:
+            feature_data_lists = [[group_feature_extractors[0].extract(y_list[0])]]
+        else:
+            feature_data_lists = extract_feature_variants(y_list, group_feature_extractors)
 
-            # Extract features
-            feature_data = feature_extraction(y=y,
-                                              fs=fs,
-                                              include_mfcc0=params['include_mfcc0'],
-                                              include_delta=params['include_delta'],
-                                              include_acceleration=params['include_acceleration'],
-                                              mfcc_params=params['mfcc'],
-                                              delta_params=params['mfcc_delta'],
-                                              acceleration_params=params['mfcc_acceleration'])
-            # Save
-            save_data(current_feature_file, feature_data)
+        # Save
+        for variant_id, feature_data_list in zip(variant_ids, feature_data_lists):
+            for (audio_filename, feature_files), feature_data in zip(group_jobs, feature_data_list):
+                if variant_id in feature_files:
+                    save_feature_file(feature_files[variant_id], feature_data)
+
+    return [audio_filename for audio_filename, feature_files in jobs]
+
+
+def save_feature_file(feature_filename, feature_data):
+    # Save through a temporary file, so that interrupted runs never leave partial feature files behind
+    temp_filename = feature_filename + '.' + str(os.getpid()) + '.tmp'
+    save_data(temp_filename, feature_data)
+    os.rename(temp_filename, feature_filename)
+
+
+feature_extractors = {}
+
+
+def get_feature_extractor(params):
+    # Feature extractor is built once per process and feature parameters
+    params_hash = get_parameter_hash(params)
+    if params_hash not in feature_extractors:
+        feature_extractors[params_hash] = FeatureExtractor.from_params(params)
+
+    return feature_extractors[params_hash]
+
+
+def do_feature_store(files, feature_cache, feature_path, overwrite=False):
+    feature_store = FeatureStore(path=feature_path)
+    if overwrite:
+        feature_store.clear()
+
+    # Collect files not yet in the store
+    files = [audio_filename for audio_filename in files if feature_cache.digest(audio_filename) not in feature_store]
+
+    def stored_items():
+        stored_digests = set()
+        for file_id, audio_filename in enumerate(files):
+            progress(title='Storing [sequences]',
+                     percentage=(float(file_id) / len(files)),
+                     note=os.path.split(audio_filename)[1])
+
+            digest = feature_cache.digest(audio_filename)
+            if digest not in stored_digests:
+                stored_digests.add(digest)
+                yield digest, load_features(audio_filename=audio_filename,
+                                            feature_cache=feature_cache,
+                                            feature_path=feature_path)
+
+    if files:
+        feature_store.append(stored_items())
+
+    feature_cache.save()
+
+
+def open_feature_store(feature_path):
+    # Feature store is optional, per-file feature files are used without it
+    feature_store = FeatureStore(path=feature_path)
+    if feature_store.exists:
+        return feature_store
+    else:
+        return None
+
+
+def load_features(audio_filename, feature_cache, feature_path, feature_store=None):
+    # Read features from the feature store when it holds the audio, from the per-file feature file otherwise
+    digest = feature_cache.digest(audio_filename)
+    if feature_store is not None and digest in feature_store:
+        return feature_store.load(digest)
+
+    feature_filename = get_feature_filename(audio_file=digest, path=feature_path)
+    if os.path.isfile(feature_filename):
+        feature_cache.touch(feature_filename)
+        return load_data(feature_filename)
+    else:
+        raise IOError("Features missing [%s]" % audio_filename)
 
 
-def do_feature_normalization(dataset, dataset_evaluation_mode, feature_normalizer_path, feature_path, overwrite=False):
+def do_feature_normalization(dataset, feature_cache, dataset_evaluation_mode, feature_normalizer_path, feature_path,
+                             single_pass=False, overwrite=False):
     # Check that target path exists, create if not
     check_path(feature_normalizer_path)
 
-    for fold in dataset.folds(mode=dataset_evaluation_mode):        
+    feature_store = open_feature_store(feature_path)
+
+    folds = []
+    for fold in dataset.folds(mode=dataset_evaluation_mode):
+        if not os.path.isfile(get_feature_normalizer_filename(fold=fold, path=feature_normalizer_path)) or overwrite:
+            folds.append(fold)
+
+    if single_pass and len(folds) > 1:
+        # Statistics of all folds are collected with one pass over the files
+        normalizers = accumulate_fold_normalizers(dataset=dataset,
+                                                  folds=folds,
+                                                  feature_cache=feature_cache,
+                                                  feature_path=feature_path,
+                                                  feature_store=feature_store)
+        for fold in folds:
+            # Calculate normalization factors
+            normalizers[fold].finalize()
+
+            # Save
+            save_data(get_feature_normalizer_filename(fold=fold, path=feature_normalizer_path), normalizers[fold])
+
+        folds = []
+
+    for fold in folds:
         current_normalizer_file = get_feature_normalizer_filename(fold=fold, path=feature_normalizer_path)
         files = []
-        if not os.path.isfile(current_normalizer_file) or overwrite:
-            # Initialize statistics
-            for item_id, item in enumerate(dataset.train(fold)):
-                if item['file'] not in files:
-                    files.append(item['file'])
 
-            file_count = len(files)
-            normalizer = FeatureNormalizer()
+        # Initialize statistics
+        for item_id, item in enumerate(dataset.train(fold)):
+            if item['file'] not in files:
+                files.append(item['file'])
+
+        file_count = len(files)
+        normalizer = FeatureNormalizer()
+
+        for file_id, audio_filename in enumerate(files):
+            progress(title='Collecting data',
+                     fold=fold,
+                     percentage=(float(file_id) / file_count),
+                     note=os.path.split(audio_filename)[1])
+
+            # Load features
+            feature_data = load_features(audio_filename=audio_filename,
+                                         feature_cache=feature_cache,
+                                         feature_path=feature_path,
+                                         feature_store=feature_store)['stat']
+
+            # Accumulate statistics
+            normalizer.accumulate(feature_data)
+
+        # Calculate normalization factors
+        normalizer.finalize()
+
+        # Save
+        save_data(current_normalizer_file, normalizer)
+
+    feature_cache.save()
+
+
+def accumulate_fold_normalizers(dataset, folds, feature_cache, feature_path, feature_store=None):
+    # Statistics are additive: every file is read once and accumulated into the grand total, and into
+    # the sums of the folds not using it in training (in cross-validation the fold testing it).
+    # Fold normalizer is the grand total minus the sums of the files the fold does not use in training.
+    fold_train_files = {}
+    files = []
+    files_found = set()
+    for fold in folds:
+        fold_train_files[fold] = set()
+        for item in dataset.train(fold):
+            fold_train_files[fold].add(item['file'])
+            if item['file'] not in files_found:
+                files_found.add(item['file'])
+                files.append(item['file'])
+
+    total = FeatureNormalizer()
+    excluded = {}
+    for file_id, audio_filename in enumerate(files):
+        progress(title='Collecting data',
+                 percentage=(float(file_id) / len(files)),
+                 note=os.path.split(audio_filename)[1])
 
-            for file_id, audio_filename in enumerate(files):
-                progress(title='Collecting data',
-                         fold=fold,
-                         percentage=(float(file_id) / file_count),
-                         note=os.path.split(audio_filename)[1])
+        # Load features
+        feature_data = load_features(audio_filename=audio_filename,
+                                     feature_cache=feature_cache,
+                                     feature_path=feature_path,
+                                     feature_store=feature_store)['stat']
 
-                # Load features
-                feature_filename = get_feature_filename(audio_file=os.path.split(audio_filename)[1], path=feature_path)
-                if os.path.isfile(feature_filename):
-                    feature_data = load_data(feature_filename)['stat']
-                else:
-                    raise IOError("Features missing [%s]" % audio_filename)
+        # Accumulate statistics
+        total.accumulate(feature_data)
 
-                # Accumulate statistics
-                normalizer.accumulate(feature_data)
+        excluded_folds = frozenset(fold for fold in folds if audio_filename not in fold_train_files[fold])
+        if excluded_folds:
+            if excluded_folds not in excluded:
+                excluded[excluded_folds] = FeatureNormalizer()
+            excluded[excluded_folds].accumulate(feature_data)
 
-            # Calculate normalization factors
-            normalizer.finalize()
+    normalizers = {}
+    for fold in folds:
+        normalizers[fold] = copy.deepcopy(total)
+        for excluded_folds, excluded_normalizer in excluded.items():
+            if fold in excluded_folds:
+                normalizers[fold].subtract(excluded_normalizer)
 
-            # Save
-            save_data(current_normalizer_file, normalizer)
+    return normalizers
 
 
-def do_system_training(dataset, dataset_evaluation_mode, model_path, feature_normalizer_path, feature_path,
-                       hop_length_seconds, classifier_params, classifier_method='gmm', overwrite=False):
-    if classifier_method != 'gmm':
+def do_system_training(dataset, feature_cache, dataset_evaluation_mode, model_path, feature_normalizer_path, feature_path,
+                       hop_length_seconds, classifier_params, classifier_method='gmm', training_data_dtype='float64',
+                       fold_normalizer=False, max_training_frames=None, streaming=False, streaming_init_frames=20000,
+                       streaming_chunk_frames=16384, workers=1, blas_threads=1, overwrite=False):
+    if classifier_method not in ['gmm', 'gmm_ubm']:
         raise ValueError("Unknown classifier method ["+classifier_method+"]")
 
     # Check that target path exists, create if not
     check_path(model_path)
 
+    feature_store = open_feature_store(feature_path)
+
     numpy.random.seed(10553)
-    for fold in dataset.folds(mode=dataset_evaluation_mode):
-        current_model_file = get_model_filename(fold=fold, path=model_path)
-        if not os.path.isfile(current_model_file) or overwrite:
-            # Load normalizer
-            feature_normalizer_filename = get_feature_normalizer_filename(fold=fold, path=feature_normalizer_path)
-            if os.path.isfile(feature_normalizer_filename):
-                normalizer = load_data(feature_normalizer_filename)
+
+    # Models of all folds are trained in one pool, collected training material is shared with
+    # the workers through memory mapped files instead of pickling it into every task.
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.Pool(processes=workers, initializer=set_blas_threads, initargs=(blas_threads,))
+
+    # Training frame files written for the pool, removed once their fold is trained, or at the end on failure
+    frames_filenames = set()
+    try:
+        model_containers = {}
+        training_tasks = []
+        for fold in dataset.folds(mode=dataset_evaluation_mode):
+            current_model_file = get_model_filename(fold=fold, path=model_path)
+            if not os.path.isfile(current_model_file) or overwrite:
+                # Load normalizer
+                feature_normalizer_filename = get_feature_normalizer_filename(fold=fold, path=feature_normalizer_path)
+                if os.path.isfile(feature_normalizer_filename):
+                    normalizer = load_data(feature_normalizer_filename)
+                else:
+                    raise IOError("Feature normalizer missing [%s]" % feature_normalizer_filename)
+
+                # Initialize model container
+                model_containers[fold] = {'normalizer': normalizer, 'models': {}}
+
+                train_items = dataset.train(fold)
+                tag_files, models = get_training_models(tags=dataset.audio_tags,
+                                                        items=train_items,
+                                                        classifier_method=classifier_method)
+
+                if streaming:
+                    # Models are trained fold by fold, the pool is used for the statistics accumulation
+                    trained_models = train_streaming_models(fold=fold,
+                                                            items=train_items,
+                                                            models=models,
+                                                            tag_files=tag_files if classifier_method == 'gmm_ubm' else None,
+                                                            feature_cache=feature_cache,
+                                                            feature_path=feature_path,
+                                                            feature_store=feature_store,
+                                                            normalizer=normalizer,
+                                                            classifier_params=classifier_params,
+                                                            init_frames=streaming_init_frames,
+                                                            chunk_frames=streaming_chunk_frames,
+                                                            pool=pool,
+                                                            workers=workers)
+                    store_trained_models(model_containers, fold, trained_models)
+                    save_model_container(model_container=model_containers.pop(fold),
+                                         model_file=current_model_file,
+                                         fold_normalizer=fold_normalizer)
+                    continue
+
+                if max_training_frames:
+                    # Every model gets its own bounded uniform sample of the frames of its files
+                    frame_sets = load_training_samples(items=train_items,
+                                                       models=models,
+                                                       feature_cache=feature_cache,
+                                                       feature_path=feature_path,
+                                                       feature_store=feature_store,
+                                                       normalizer=normalizer,
+                                                       fold=fold,
+                                                       max_frames=max_training_frames,
+                                                       dtype=training_data_dtype,
+                                                       random_state=classifier_params.get('random_state'))
+                    if pool is not None:
+                        for model_id, (data, file_offsets, file_frame_counts) in enumerate(frame_sets):
+                            frames_filename = get_training_frames_filename(fold=fold, path=model_path, model_id=model_id)
+                            frames_filenames.add(frames_filename)
+                            numpy.save(frames_filename, data)
+                            frame_sets[model_id] = (frames_filename, file_offsets, file_frame_counts)
+
+                else:
+                    # Load and normalize the training material once, all tags select their examples from it
+                    frames_filename = None
+                    if pool is not None:
+                        frames_filename = get_training_frames_filename(fold=fold, path=model_path)
+                        frames_filenames.add(frames_filename)
+
+                    data, file_offsets = load_training_data(items=train_items,
+                                                            feature_cache=feature_cache,
+                                                            feature_path=feature_path,
+                                                            feature_store=feature_store,
+                                                            normalizer=normalizer,
+                                                            fold=fold,
+                                                            dtype=training_data_dtype,
+                                                            filename=frames_filename)
+
+                    frame_sets = [(data if pool is None else frames_filename, file_offsets, numpy.diff(file_offsets))] * len(models)
+
+                fold_tasks = get_training_tasks(fold=fold,
+                                                models=models,
+                                                tag_files=tag_files,
+                                                frame_sets=frame_sets,
+                                                classifier_params=classifier_params)
+
+                if pool is None:
+                    # Train models of the fold before collecting the next one
+                    for task in fold_tasks:
+                        progress(title='Train models', fold=fold, label=task['label'])
+                        store_trained_models(model_containers, *train_model(task))
+
+                    save_model_container(model_container=model_containers.pop(fold),
+                                         model_file=current_model_file,
+                                         fold_normalizer=fold_normalizer)
+                else:
+                    training_tasks += fold_tasks
+
+                # Release the training material of the fold before collecting the next one
+                data = frame_sets = fold_tasks = None
+
+        if training_tasks:
+            # Start from the largest fits to keep the workers busy until the end
+            training_tasks.sort(key=lambda task: task['frame_count'], reverse=True)
+            remaining_tasks = dict((fold, 0) for fold in model_containers)
+            for task in training_tasks:
+                remaining_tasks[task['fold']] += 1
+
+            for fold, trained_models in pool.imap_unordered(train_model, training_tasks):
+                progress(title='Train models', fold=fold, label=trained_models[0][0] or 'UBM')
+                store_trained_models(model_containers, fold, trained_models)
+
+                remaining_tasks[fold] -= 1
+                if not remaining_tasks[fold]:
+                    save_model_container(model_container=model_containers.pop(fold),
+                                         model_file=get_model_filename(fold=fold, path=model_path),
+                                         fold_normalizer=fold_normalizer)
+                    for frames_filename in set(task['data'] for task in training_tasks if task['fold'] == fold):
+                        os.remove(frames_filename)
+                        frames_filenames.discard(frames_filename)
+
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+        for frames_filename in frames_filenames:
+            if os.path.isfile(frames_filename):
+                os.remove(frames_filename)
+
+    feature_cache.save()
+
+
+def get_training_frames_filename(fold, path, model_id=None):
+    if model_id is not None:
+        return os.path.join(path, 'training_frames_fold' + str(fold) + '_' + str(model_id) + '.npy')
+    return os.path.join(path, 'training_frames_fold' + str(fold) + '.npy')
+
+
+def get_model_seed(random_state, fold, tag, polarity):
+    # Seed of each model depends only on the model, not on the order in which models are trained
+    return int(get_parameter_hash([random_state, fold, tag, polarity])[:8], 16)
+
+
+def get_training_models(tags, items, classifier_method='gmm'):
+    # Models to train as (tag, polarity, selected files), with gmm_ubm only the UBM of the fold is trained
+    # and the tag models are adapted from it.
+    # Select positive and negative training examples, frame order follows the file order
+    tag_files = [(tag, numpy.array([tag in item['tags'] for item in items], dtype=bool)) for tag in tags]
+
+    if classifier_method == 'gmm_ubm':
+        models = [(None, 'ubm', numpy.ones(len(items), dtype=bool))]
+    else:
+        models = []
+        for tag, positive_files in tag_files:
+            models += [(tag, 'positive', positive_files), (tag, 'negative', ~positive_files)]
+
+    return tag_files, models
+
+
+def get_training_tasks(fold, models, tag_files, frame_sets, classifier_params):
+    # One task per model. Frame set of the model is (data, file_offsets, file_frame_counts), data is either the
+    # frame matrix or the filename of the memory mapped frame matrix, and file_frame_counts the frame counts of
+    # the files before subsampling.
+    classifier_params = dict(classifier_params)
+    relevance_factor = classifier_params.pop('relevance_factor', None)
+
+    tasks = []
+    for (tag, polarity, selected_files), (data, file_offsets, file_frame_counts) in zip(models, frame_sets):
+        params = dict(classifier_params)
+        params['random_state'] = get_model_seed(random_state=classifier_params.get('random_state'),
+                                                fold=fold,
+                                                tag=tag,
+                                                polarity=polarity)
+        task = {
+            'fold': fold,
+            'tag': tag,
+            'polarity': polarity,
+            'label': tag or 'UBM',
+            'data': data,
+            'selected_files': selected_files,
+            'file_offsets': file_offsets,
+            'file_frame_counts': file_frame_counts,
+            'frame_count': int(numpy.sum(numpy.diff(file_offsets)[selected_files])),
+            'classifier_params': params,
+        }
+        if polarity == 'ubm':
+            task['tag_files'] = tag_files
+            task['relevance_factor'] = relevance_factor
+        tasks.append(task)
+
+    return tasks
+
+
+def train_model(task):
+    data = task['data']
+    if isinstance(data, basestring):
+        data = numpy.load(data, mmap_mode='r')
+
+    selected_frames = numpy.repeat(task['selected_files'], numpy.diff(task['file_offsets']))
+    model = mixture.GMM(**task['classifier_params']).fit(data[selected_frames])
+
+    models = [(task['tag'], task['polarity'], model)]
+    if task['polarity'] == 'ubm':
+        # Tag models are adapted from the UBM, statistics of each file are collected with one E-step
+        file_offsets = task['file_offsets']
+        zeroth = numpy.zeros((len(file_offsets) - 1, ) + model.weights_.shape)
+        first = numpy.zeros((len(file_offsets) - 1, ) + model.means_.shape)
+        for file_id in range(len(file_offsets) - 1):
+            if file_offsets[file_id + 1] > file_offsets[file_id]:
+                zeroth[file_id], first[file_id] = gmm_statistics(model, data[file_offsets[file_id]:file_offsets[file_id + 1]])
+
+        for tag, positive_files in task['tag_files']:
+            for polarity, selected_files in [('positive', positive_files), ('negative', ~positive_files)]:
+                # Statistics of subsampled frames are scaled up to the frame count of the files
+                scale = numpy.sum(task['file_frame_counts'][selected_files]) / float(max(numpy.sum(numpy.diff(file_offsets)[selected_files]), 1))
+                models.append((tag, polarity, map_adapt_means(ubm=model,
+                                                              zeroth=scale * numpy.sum(zeroth[selected_files], axis=0),
+                                                              first=scale * numpy.sum(first[selected_files], axis=0),
+                                                              relevance_factor=task['relevance_factor'])))
+
+    return task['fold'], models
+
+
+def store_trained_models(model_containers, fold, models):
+    for tag, polarity, model in models:
+        if polarity == 'ubm':
+            model_containers[fold]['ubm'] = model
+        else:
+            model_containers[fold]['models'].setdefault(tag, {})[polarity] = model
+
+
+def train_streaming_models(fold, items, models, tag_files, feature_cache, feature_path, feature_store, normalizer,
+                           classifier_params, init_frames, chunk_frames, pool=None, workers=1):
+    # Train the models, (tag, polarity, selected files), with EM streaming over the feature files, without
+    # collecting the training frames. Models are initialized on a bounded sample of their frames, and every
+    # EM iteration accumulates the sufficient statistics of all unconverged models of the fold in one pass over
+    # the files. With pool, the files are split among the workers and their statistics merged.
+    classifier_params = dict(classifier_params)
+    relevance_factor = classifier_params.pop('relevance_factor', None)
+    n_iter = classifier_params.get('n_iter', 100)
+    tol = classifier_params.get('tol', 0.001)
+
+    # Initialize models like sklearn.mixture.GMM.fit does, on the sampled frames
+    samples = load_training_samples(items=items,
+                                    models=models,
+                                    feature_cache=feature_cache,
+                                    feature_path=feature_path,
+                                    feature_store=feature_store,
+                                    normalizer=normalizer,
+                                    fold=fold,
+                                    max_frames=init_frames,
+                                    random_state=classifier_params.get('random_state'))
+    trained_models = []
+    for (tag, polarity, selected_files), (data, file_offsets, file_frame_counts) in zip(models, samples):
+        params = dict(classifier_params)
+        params['n_iter'] = 0
+        params['n_init'] = 1
+        params['random_state'] = get_model_seed(random_state=classifier_params.get('random_state'),
+                                                fold=fold,
+                                                tag=tag,
+                                                polarity=polarity)
+        model = mixture.GMM(**params).fit(data)
+        model.n_iter = n_iter
+        trained_models.append(model)
+    samples = None
+
+    previous_log_likelihoods = [None] * len(models)
+    for iteration in range(n_iter):
+        active = [model_id for model_id, model in enumerate(trained_models) if not model.converged_]
+        if not active:
+            break
+
+        progress(title='Train models',
+                 fold=fold,
+                 percentage=float(iteration) / n_iter,
+                 note='{:d} models left'.format(len(active)))
+
+        statistics = accumulate_streaming_statistics(items=items,
+                                                     models=[models[model_id] for model_id in active],
+                                                     gmms=[trained_models[model_id] for model_id in active],
+                                                     feature_cache=feature_cache,
+                                                     feature_path=feature_path,
+                                                     normalizer=normalizer,
+                                                     chunk_frames=chunk_frames,
+                                                     pool=pool,
+                                                     workers=workers)
+
+        for model_id, model_statistics in zip(active, statistics):
+            # Convergence is checked before the M-step, like sklearn.mixture.GMM.fit does
+            log_likelihood = model_statistics.log_likelihood / max(model_statistics.frame_count, 1)
+            if previous_log_likelihoods[model_id] is not None and abs(log_likelihood - previous_log_likelihoods[model_id]) < tol:
+                trained_models[model_id].converged_ = True
             else:
-                raise IOError("Feature normalizer missing [%s]" % feature_normalizer_filename)
-
-            # Initialize model container
-            model_container = {'normalizer': normalizer, 'models': {}}
-
-            for tag_id, tag in enumerate(dataset.audio_tags):
-
-                # Restructure training data
-                positive_files = []
-                negative_files = []
-                for id, item in enumerate(dataset.train(fold)):
-                    if tag in item['tags']:
-                        positive_files.append(item)
-                    else:
-                        negative_files.append(item)
-
-                # Collect positive training examples
-                data_positive = None
-                for id, item in enumerate(positive_files):
-                    progress(title='Collecting data [positive] ',
-                             fold=fold,
-                             label=tag,
-                             percentage=(float(id) / len(positive_files)),
-                             note=os.path.split(item['file'])[1])
-                    
-                    # Load features
-                    feature_filename = get_feature_filename(audio_file=os.path.split(item['file'])[1], path=feature_path)
-                    if os.path.isfile(feature_filename):
-                        feature_data = load_data(feature_filename)['feat']
-                    else:
-                        raise IOError("Features missing [%s]" % feature_filename)
-
-                    # Normalize features
-                    feature_data = model_container['normalizer'].normalize(feature_data)
-
-                    # Store features per class label
-                    if data_positive is None:
-                        data_positive = feature_data
-                    else:
-                        data_positive = numpy.vstack((data_positive, feature_data))
-                
-                # Collect negative training examples
-                data_negative = None
-                for id, item in enumerate(negative_files):
-                    progress(title='Collecting data [negative] ',
-                             fold=fold,
-                             label=tag,
-                             percentage=(float(id) / len(negative_files)),
-                             note=os.path.split(item['file'])[1])
-
-                    # Load features
-                    feature_filename = get_feature_filename(audio_file=os.path.split(item['file'])[1], path=feature_path)
-                    if os.path.isfile(feature_filename):
-                        feature_data = load_data(feature_filename)['feat']
-                    else:
-                        raise IOError("Features missing [%s]" % feature_filename)
-
-                    # Normalize features
-                    feature_data = model_container['normalizer'].normalize(feature_data)
-
-                    # Store features per class label
-                    if data_negative is None:
-                        data_negative = feature_data
-                    else:
-                        data_negative = numpy.vstack((data_negative, feature_data))
-
-                # Train models
-                progress(title='Train models',fold=fold,label=tag)
-                model_container['models'][tag] = {}
-                model_container['models'][tag]['positive'] = mixture.GMM(**classifier_params).fit(data_positive)
-                model_container['models'][tag]['negative'] = mixture.GMM(**classifier_params).fit(data_negative)
-
-            # Save models
-            save_data(current_model_file, model_container)
-
-
-def do_system_testing(dataset, dataset_evaluation_mode, result_path, model_path, feature_path, feature_params, classifier_method='gmm',
-                      overwrite=False):
-
-    if classifier_method != 'gmm':
+                trained_models[model_id] = model_statistics.update(trained_models[model_id])
+            previous_log_likelihoods[model_id] = log_likelihood
+
+    trained_models = [(tag, polarity, model) for (tag, polarity, selected_files), model in zip(models, trained_models)]
+
+    if tag_files is not None:
+        # Tag models are adapted from the UBM. Statistics of each file are collected with one E-step pass and
+        # added to the statistics of every tag model selecting the file, like in train_model
+        ubm = trained_models[0][2]
+        adapted_models = []
+        for tag, positive_files in tag_files:
+            adapted_models += [(tag, 'positive', positive_files), (tag, 'negative', ~positive_files)]
+
+        zeroth, first = accumulate_adaptation_statistics(items=items,
+                                                         models=adapted_models,
+                                                         ubm=ubm,
+                                                         feature_cache=feature_cache,
+                                                         feature_path=feature_path,
+                                                         normalizer=normalizer,
+                                                         pool=pool,
+                                                         workers=workers)
+
+        for model_id, (tag, polarity, selected_files) in enumerate(adapted_models):
+            trained_models.append((tag, polarity, map_adapt_means(ubm=ubm,
+                                                                  zeroth=zeroth[model_id],
+                                                                  first=first[model_id],
+                                                                  relevance_factor=relevance_factor)))
+
+    return trained_models
+
+
+def accumulate_streaming_statistics(items, models, gmms, feature_cache, feature_path, normalizer, chunk_frames,
+                                    pool=None, workers=1):
+    # Sufficient statistics of the gmms over the files selected for each model, (tag, polarity, selected files)
+    selected_files = numpy.array([model[2] for model in models]).T
+    tasks = []
+    for file_ids in numpy.array_split(numpy.arange(len(items)), workers if pool is not None else 1):
+        tasks.append({
+            'files': [items[file_id]['file'] for file_id in file_ids],
+            'selected_files': selected_files[file_ids],
+            'gmms': gmms,
+            'feature_cache': feature_cache,
+            'feature_path': feature_path,
+            'normalizer': normalizer,
+            'chunk_frames': chunk_frames,
+        })
+
+    if pool is None:
+        return accumulate_gmm_statistics(tasks[0])
+
+    statistics = None
+    for task_statistics in pool.imap_unordered(accumulate_gmm_statistics, tasks):
+        if statistics is None:
+            statistics = task_statistics
+        else:
+            for model_statistics, model_task_statistics in zip(statistics, task_statistics):
+                model_statistics.merge(model_task_statistics)
+
+    return statistics
+
+
+def accumulate_gmm_statistics(task):
+    # Frames of the files selected for a gmm are buffered into chunks of about chunk_frames frames for the E-step
+    feature_store = open_feature_store(task['feature_path'])
+    gmms = task['gmms']
+    statistics = [GMMStatistics.from_model(gmm) for gmm in gmms]
+    chunks = [[] for gmm in gmms]
+    chunk_frames = [0] * len(gmms)
+
+    for file_id, audio_filename in enumerate(task['files']):
+        # Load and normalize features
+        feature_data = load_features(audio_filename=audio_filename,
+                                     feature_cache=task['feature_cache'],
+                                     feature_path=task['feature_path'],
+                                     feature_store=feature_store)['feat']
+        feature_data = task['normalizer'].normalize(feature_data)
+
+        for model_id in numpy.flatnonzero(task['selected_files'][file_id]):
+            chunks[model_id].append(feature_data)
+            chunk_frames[model_id] += feature_data.shape[0]
+            if chunk_frames[model_id] >= task['chunk_frames']:
+                statistics[model_id].accumulate(gmms[model_id], numpy.concatenate(chunks[model_id]))
+                chunks[model_id] = []
+                chunk_frames[model_id] = 0
+
+    for model_id in range(len(gmms)):
+        if chunks[model_id]:
+            statistics[model_id].accumulate(gmms[model_id], numpy.concatenate(chunks[model_id]))
+
+    return statistics
+
+
+def accumulate_adaptation_statistics(items, models, ubm, feature_cache, feature_path, normalizer, pool=None, workers=1):
+    # Zeroth and first order statistics under the UBM over the files selected for each model, (tag, polarity,
+    # selected files), see gmm_statistics. With pool, the files are split among the workers and their statistics summed.
+    selected_files = numpy.array([model[2] for model in models]).T
+    tasks = []
+    for file_ids in numpy.array_split(numpy.arange(len(items)), workers if pool is not None else 1):
+        tasks.append({
+            'files': [items[file_id]['file'] for file_id in file_ids],
+            'selected_files': selected_files[file_ids],
+            'ubm': ubm,
+            'feature_cache': feature_cache,
+            'feature_path': feature_path,
+            'normalizer': normalizer,
+        })
+
+    if pool is None:
+        return accumulate_ubm_statistics(tasks[0])
+
+    zeroth, first = 0.0, 0.0
+    for task_zeroth, task_first in pool.imap_unordered(accumulate_ubm_statistics, tasks):
+        zeroth = zeroth + task_zeroth
+        first = first + task_first
+
+    return zeroth, first
+
+
+def accumulate_ubm_statistics(task):
+    # One E-step per file, its statistics are added to every model selecting the file
+    feature_store = open_feature_store(task['feature_path'])
+    ubm = task['ubm']
+    model_count = task['selected_files'].shape[1]
+    zeroth = numpy.zeros((model_count, ) + ubm.weights_.shape)
+    first = numpy.zeros((model_count, ) + ubm.means_.shape)
+
+    for file_id, audio_filename in enumerate(task['files']):
+        model_ids = numpy.flatnonzero(task['selected_files'][file_id])
+        if not len(model_ids):
+            continue
+
+        # Load and normalize features
+        feature_data = load_features(audio_filename=audio_filename,
+                                     feature_cache=task['feature_cache'],
+                                     feature_path=task['feature_path'],
+                                     feature_store=feature_store)['feat']
+        feature_data = task['normalizer'].normalize(feature_data)
+
+        if feature_data.shape[0]:
+            file_zeroth, file_first = gmm_statistics(ubm, feature_data)
+            zeroth[model_ids] += file_zeroth
+            first[model_ids] += file_first
+
+    return zeroth, first
+
+
+def save_model_container(model_container, model_file, fold_normalizer=False):
+    if fold_normalizer:
+        # Models score raw features, no normalization needed at inference
+        model_container = fold_normalizer_into_model_container(model_container)
+
+    save_data(model_file, model_container)
+
+
+def load_training_data(items, feature_cache, feature_path, feature_store, normalizer, fold, dtype='float64', filename=None):
+    # Load normalized features of the items into one preallocated frame matrix,
+    # frames of items[i] are stored in rows file_offsets[i]:file_offsets[i+1].
+    # Matrix is sized by the sum of the per-file stat['N'] of the items (repeated items are counted for every
+    # occurrence), with filename it is stored into a memory mapped .npy file.
+    start_time = time.time()
+    frame_count = 0
+    for item in items:
+        frame_count += load_features(audio_filename=item['file'],
+                                     feature_cache=feature_cache,
+                                     feature_path=feature_path,
+                                     feature_store=feature_store)['stat']['N']
+
+    frame_buffer = FrameBuffer(frame_count=frame_count,
+                               dimension=normalizer.mean.shape[-1],
+                               dtype=numpy.dtype(dtype),
+                               filename=filename)
+
+    for id, item in enumerate(items):
+        progress(title='Collecting data',
+                 fold=fold,
+                 percentage=(float(id) / len(items)),
+                 note=os.path.split(item['file'])[1])
+
+        # Load features
+        feature_data = load_features(audio_filename=item['file'],
+                                     feature_cache=feature_cache,
+                                     feature_path=feature_path,
+                                     feature_store=feature_store)['feat']
+
+        # Normalize features into the buffer
+        frame_buffer.append(feature_data, normalizer=normalizer)
+
+    data, file_offsets = frame_buffer.finalize()
+
+    print "  Collected {:d} frames, fold[{:d}] [{:.1f} sec] [{:.1f} MB {:s}] [peak RSS {:.1f} MB]                ".format(
+        frame_buffer.frame_count,
+        fold,
+        time.time() - start_time,
+        frame_buffer.nbytes / float(1024 ** 2),
+        data.dtype.name,
+        get_peak_memory_usage() / float(1024 ** 2))
+
+    return data, file_offsets
+
+
+def load_training_samples(items, models, feature_cache, feature_path, feature_store, normalizer, fold, max_frames,
+                          dtype='float64', random_state=None):
+    # Draw a uniform sample of at most max_frames normalized frames for each model, (tag, polarity, selected files),
+    # while the files stream past. Each model has its own reservoir seeded from the model, so the samples are
+    # reproducible. Returns (data, file_offsets, file_frame_counts) per model, frames of items[i] are stored in
+    # rows file_offsets[i]:file_offsets[i+1] and file_frame_counts[i] is the frame count of items[i] before sampling.
+    start_time = time.time()
+    reservoirs = []
+    for tag, polarity, selected_files in models:
+        reservoirs.append(FrameReservoir(capacity=int(min(max_frames, normalizer.N)),
+                                         dimension=normalizer.mean.shape[-1],
+                                         file_count=len(items),
+                                         dtype=numpy.dtype(dtype),
+                                         random_state=get_model_seed(random_state=random_state,
+                                                                     fold=fold,
+                                                                     tag=tag,
+                                                                     polarity=polarity)))
+
+    for id, item in enumerate(items):
+        progress(title='Sampling data',
+                 fold=fold,
+                 percentage=(float(id) / len(items)),
+                 note=os.path.split(item['file'])[1])
+
+        # Load features
+        feature_data = load_features(audio_filename=item['file'],
+                                     feature_cache=feature_cache,
+                                     feature_path=feature_path,
+                                     feature_store=feature_store)['feat']
+
+        # Normalize features once, and offer them to the reservoirs of the models using the file
+        feature_data = normalizer.normalize(feature_data)
+        for reservoir, (tag, polarity, selected_files) in zip(reservoirs, models):
+            if selected_files[id]:
+                reservoir.append(feature_data, file_id=id)
+
+    print "  Sampled {:d} of {:d} frames, fold[{:d}] [{:d} models] [{:.1f} sec] [{:.1f} MB {:s}] [peak RSS {:.1f} MB]                ".format(
+        sum(reservoir.kept for reservoir in reservoirs),
+        sum(reservoir.seen for reservoir in reservoirs),
+        fold,
+        len(reservoirs),
+        time.time() - start_time,
+        sum(reservoir.nbytes for reservoir in reservoirs) / float(1024 ** 2),
+        numpy.dtype(dtype).name,
+        get_peak_memory_usage() / float(1024 ** 2))
+
+    frame_sets = []
+    while reservoirs:
+        reservoir = reservoirs.pop(0)
+        data, file_offsets = reservoir.finalize()
+        frame_sets.append((data, file_offsets, reservoir.file_frame_counts))
+
+    return frame_sets
+
+
+def do_system_testing(dataset, feature_cache, dataset_evaluation_mode, result_path, model_path, feature_path, feature_params, classifier_method='gmm',
+                      scoring='native', scoring_dtype='float64', shortlist=None, batch_size=1, overwrite=False):
+
+    if classifier_method not in ['gmm', 'gmm_ubm']:
         raise ValueError("Unknown classifier method ["+classifier_method+"]")
 
     # Check that target path exists, create if not
     check_path(result_path)
 
+    feature_store = open_feature_store(feature_path)
     for fold in dataset.folds(mode=dataset_evaluation_mode):
         current_result_file = get_result_filename(fold=fold, path=result_path)
 
-        if not os.path.isfile(current_result_file) or overwrite:
+        # With shortlist, the results of exact scoring are needed as well
+        reference_missing = shortlist and not os.path.isfile(get_reference_result_filename(fold=fold, path=result_path))
+
+        if not os.path.isfile(current_result_file) or reference_missing or overwrite:
             results = []
             
             # Load class model container
             model_filename = get_model_filename(fold=fold, path=model_path)
             if os.path.isfile(model_filename):
-                model_container = load_data(model_filename)
+                model_container = add_model_scorer(model_container=load_data(model_filename),
+                                                   scoring=scoring,
+                                                   dtype=scoring_dtype,
+                                                   shortlist=shortlist)
             else:
                 raise IOError("Model file not found [%s]" % model_filename)
 
-            file_count = len(dataset.test(fold=fold))
-            for id, item in enumerate(dataset.test(fold=fold)):
+            if shortlist:
+                # Exact scoring of the same models, for the reference results of the approximate scoring
+                reference_results = []
+                reference_model_container = add_model_scorer(model_container=dict(model_container),
+                                                             scoring=scoring,
+                                                             dtype=scoring_dtype)
+
+            test_items = dataset.test(fold=fold)
+            file_count = len(test_items)
+            for batch_start in range(0, file_count, batch_size):
+                batch_items = test_items[batch_start:batch_start + batch_size]
                 progress(title='Testing',
                          fold=fold,
-                         percentage=(float(id) / file_count),
-                         note=os.path.split(item['file'])[1])
+                         percentage=(float(batch_start) / file_count),
+                         note=os.path.split(batch_items[0]['file'])[1])
 
                 # Load features
-                feature_filename = get_feature_filename(audio_file=os.path.split(item['file'])[1], path=feature_path)
-                if os.path.isfile(feature_filename):
-                    feature_data = load_data(feature_filename)['feat']
+                feature_matrices = []
+                for item in batch_items:
+                    feature_matrices.append(load_features(audio_filename=item['file'],
+                                                          feature_cache=feature_cache,
+                                                          feature_path=feature_path,
+                                                          feature_store=feature_store)['feat'])
+
+                # Normalize features into one matrix, unless the normalizer is folded into the models
+                if model_container.get('normalizer_folded'):
+                    normalizer = None
+                    dtype = numpy.result_type(*feature_matrices)
                 else:
-                    raise IOError("Features missing [%s]" % feature_filename)
-
-                # Normalize features
-                feature_data = model_container['normalizer'].normalize(feature_data)
-
-                current_result = binary_classifier(feature_data=feature_data,
-                                                 model_container=model_container)
-
-                for label in current_result:
-                    _, file_name = os.path.split(item['file'])
-                    results.append((file_name, label, current_result[label] ))
+                    normalizer = model_container['normalizer']
+                    dtype = numpy.float64
+
+                frame_buffer = FrameBuffer(frame_count=sum(feature_matrix.shape[0] for feature_matrix in feature_matrices),
+                                           dimension=feature_matrices[0].shape[1],
+                                           dtype=dtype)
+                for feature_matrix in feature_matrices:
+                    frame_buffer.append(feature_matrix, normalizer=normalizer)
+                feature_data, clip_offsets = frame_buffer.finalize()
+
+                batch_results = binary_classifier_batch(feature_data=feature_data,
+                                                        clip_offsets=clip_offsets,
+                                                        model_container=model_container)
+
+                for item, current_result in zip(batch_items, batch_results):
+                    for label in current_result:
+                        _, file_name = os.path.split(item['file'])
+                        results.append((file_name, label, current_result[label] ))
+
+                if shortlist:
+                    batch_results = binary_classifier_batch(feature_data=feature_data,
+                                                            clip_offsets=clip_offsets,
+                                                            model_container=reference_model_container)
+
+                    for item, current_result in zip(batch_items, batch_results):
+                        for label in current_result:
+                            _, file_name = os.path.split(item['file'])
+                            reference_results.append((file_name, label, current_result[label]))
 
             # Save testing results
             with open(current_result_file, 'wt') as f:
@@ -439,75 +1301,183 @@ def do_system_testing(dataset, dataset_evaluation_mode, result_path, model_path,
                 for result_item in results:
                     writer.writerow(result_item)
 
+            if shortlist:
+                with open(get_reference_result_filename(fold=fold, path=result_path), 'wt') as f:
+                    writer = csv.writer(f, delimiter=',')
+                    for result_item in reference_results:
+                        writer.writerow(result_item)
+
+    feature_cache.save()
+
+
+def add_model_scorer(model_container, scoring='native', dtype='float64', shortlist=None):
+    # Prepare the scoring of all models of the container once after loading, models are ordered by label,
+    # positive model before negative model. Mean adapted models are scored through their shared UBM.
+    # With shortlist, only the top components of each frame are evaluated (native scoring only).
+    labels = list(model_container['models'])
+    models = []
+    for label in labels:
+        models += [model_container['models'][label]['positive'], model_container['models'][label]['negative']]
+
+    if scoring == 'sklearn':
+        scorer = None
+    elif scoring == 'native':
+        if 'ubm' in model_container:
+            scorer = AdaptedGMMScorer(ubm=model_container['ubm'], models=models, dtype=dtype, shortlist=shortlist)
+        else:
+            scorer = GMMScorer(models=models, dtype=dtype, shortlist=shortlist)
+    else:
+        raise ValueError("Unknown scoring [%s]" % scoring)
 
-def binary_classifier(feature_data, model_container): 
-    likelihood_ratios = {}
-
-    for label_id, label in enumerate(model_container['models']):
-        positive = numpy.sum(model_container['models'][label]['positive'].score(feature_data))
-        negative = numpy.sum(model_container['models'][label]['negative'].score(feature_data))
-
-        likelihood_ratios[label] = positive - negative
+    model_container['scorer'] = {'labels': labels, 'models': models, 'scorer': scorer}
+    return model_container
 
-    return likelihood_ratios
 
-def do_system_evaluation(dataset, dataset_evaluation_mode, result_path):
+def binary_classifier(feature_data, model_container): 
+    return binary_classifier_batch(feature_data=feature_data,
+                                   clip_offsets=numpy.array([0, feature_data.shape[0]]),
+                                   model_container=model_container)[0]
+
+
+def binary_classifier_batch(feature_data, clip_offsets, model_container):
+    # Likelihood ratios of clips concatenated into one feature matrix, frames of clip i are stored in rows
+    # clip_offsets[i]:clip_offsets[i+1]. Every clip is scored on its own, so the scores of a clip do not depend on
+    # the other clips of the batch, and results of all batch sizes are identical to scoring clip by clip.
+    if 'scorer' not in model_container:
+        add_model_scorer(model_container)
+
+    labels = model_container['scorer']['labels']
+    scorer = model_container['scorer']['scorer']
+    clip_count = len(clip_offsets) - 1
+
+    if scorer is not None:
+        # All models scored at once
+        log_likelihoods = scorer.score_segments(feature_data, clip_offsets[:-1])
+    else:
+        log_likelihoods = numpy.empty((clip_count, len(model_container['scorer']['models'])))
+        for clip_id in range(clip_count):
+            clip_feature_data = numpy.array(feature_data[clip_offsets[clip_id]:clip_offsets[clip_id + 1]])
+            for model_id, model in enumerate(model_container['scorer']['models']):
+                log_likelihoods[clip_id, model_id] = numpy.sum(model.score(clip_feature_data))
+
+    results = []
+    for clip_id in range(clip_count):
+        likelihood_ratios = {}
+        for label_id, label in enumerate(labels):
+            likelihood_ratios[label] = log_likelihoods[clip_id, 2 * label_id] - log_likelihoods[clip_id, 2 * label_id + 1]
+        results.append(likelihood_ratios)
+
+    return results
+
+def do_system_evaluation(dataset, dataset_evaluation_mode, result_path, reference=False):
     
     # Set warnings off, sklearn metrics will trigger warning for classes without
     # predicted samples in F1-scoring. This is just to keep printing clean.
     #warnings.simplefilter("ignore")
     
     fold_wise_class_eer = numpy.zeros((len(dataset.folds(mode=dataset_evaluation_mode)), dataset.audio_tag_count))
+    reference_fold_wise_class_eer = numpy.zeros((len(dataset.folds(mode=dataset_evaluation_mode)), dataset.audio_tag_count))
 
-    for fold in dataset.folds(mode=dataset_evaluation_mode):
-        class_wise_eer       = numpy.zeros((dataset.audio_tag_count))
-        results = []
-        result_filename = get_result_filename(fold=fold, path=result_path)
-        if os.path.isfile(result_filename):
-            with open(result_filename, 'rt') as f:
-                for row in csv.reader(f, delimiter=','):
-                    results.append(row)
-        else:
-            raise IOError("Result file not found [%s]" % result_filename)
-
-        for tag_id,tag in enumerate(dataset.audio_tags):
-
-            y_true_binary = []
-            y_true_file = []
-            y_score = []
-            for result in results:
-                if tag == result[1]:
-                    relative_path = dataset.package_list[0]['local_audio_path'].replace(dataset.local_path,'')[1:] + os.path.sep + result[0]
-                    y_true_file.append(result[0])
-                    if tag in dataset.file_meta(relative_path)[0]['tags']:
-                        y_true_binary.append(1)
-                    else:
-                        y_true_binary.append(0)
-
-                    y_score.append(float(result[2]))
-
-            if numpy.any(y_true_binary):
-                class_wise_eer[tag_id] = compute_eer(result_filename, tag, dict(zip(y_true_file, y_true_binary)))
-            else:
-                class_wise_eer[tag_id] = None
+    # Ground truth tags of all files, looked up once for all folds
+    tag_index = get_tag_index(dataset)
 
-        fold_wise_class_eer[fold - 1 if fold > 0 else fold, :] = class_wise_eer
+    for fold in dataset.folds(mode=dataset_evaluation_mode):
+        fold_wise_class_eer[fold - 1 if fold > 0 else fold, :] = evaluate_result_file(dataset=dataset,
+                                                                                      result_filename=get_result_filename(fold=fold, path=result_path),
+                                                                                      tag_index=tag_index)
+        if reference:
+            # Results of exact scoring, for the error of approximate scoring
+            reference_fold_wise_class_eer[fold - 1 if fold > 0 else fold, :] = evaluate_result_file(dataset=dataset,
+                                                                                                    result_filename=get_reference_result_filename(fold=fold, path=result_path),
+                                                                                                    tag_index=tag_index)
 
     print "  File-wise evaluation, over %d folds" % (dataset.fold_count)
 
-    print "     {:20s} | {:8s}".format('Tag', 'EER')
-    print "     ==============================================="
     labels = numpy.array([dataset.tagcode_to_taglabel(t) for t in dataset.audio_tags])
-    for i in numpy.argsort(labels):
-        print "     {:20s} | {:3.3f} ".format(labels[i],
-                                                                    numpy.nanmean(fold_wise_class_eer[:,i])
-                                                                    )
-    print "     ==============================================="
-    print "     {:20s} | {:3.3f} ".format('Mean error',
-                                                      numpy.mean(numpy.nanmean(fold_wise_class_eer))
-                                                      )
+    if not reference:
+        print "     {:20s} | {:8s}".format('Tag', 'EER')
+        print "     ==============================================="
+        for i in numpy.argsort(labels):
+            print "     {:20s} | {:3.3f} ".format(labels[i],
+                                                                        numpy.nanmean(fold_wise_class_eer[:,i])
+                                                                        )
+        print "     ==============================================="
+        print "     {:20s} | {:3.3f} ".format('Mean error',
+                                                          numpy.mean(numpy.nanmean(fold_wise_class_eer))
+                                                          )
+    else:
+        print "     {:20s} | {:8s} | {:8s} | {:8s}".format('Tag', 'EER', 'Exact', 'Delta')
+        print "     ==============================================="
+        for i in numpy.argsort(labels):
+            print "     {:20s} | {:3.3f}    | {:3.3f}    | {:+3.3f} ".format(labels[i],
+                                                                        numpy.nanmean(fold_wise_class_eer[:,i]),
+                                                                        numpy.nanmean(reference_fold_wise_class_eer[:,i]),
+                                                                        numpy.nanmean(fold_wise_class_eer[:,i]) - numpy.nanmean(reference_fold_wise_class_eer[:,i])
+                                                                        )
+        print "     ==============================================="
+        print "     {:20s} | {:3.3f}    | {:3.3f}    | {:+3.3f} ".format('Mean error',
+                                                          numpy.mean(numpy.nanmean(fold_wise_class_eer)),
+                                                          numpy.mean(numpy.nanmean(reference_fold_wise_class_eer)),
+                                                          numpy.mean(numpy.nanmean(fold_wise_class_eer)) - numpy.mean(numpy.nanmean(reference_fold_wise_class_eer))
+                                                          )
     # Restore warnings to default settings
     warnings.simplefilter("default")    
-    
+
+
+def get_tag_index(dataset):
+    # Tags of each file in the dataset meta, from the first meta item of the file like dataset.file_meta
+    tag_index = {}
+    for item in dataset.meta:
+        if item['file'] not in tag_index:
+            tag_index[item['file']] = set(item.get('tags', []))
+    return tag_index
+
+
+def evaluate_result_file(dataset, result_filename, tag_index=None):
+    # Tag-wise EER of one result file. The result file is parsed once into arrays of file ids, tags and scores,
+    # and the ground truth is looked up from the tag index (see get_tag_index).
+    if tag_index is None:
+        tag_index = get_tag_index(dataset)
+
+    class_wise_eer       = numpy.zeros((dataset.audio_tag_count))
+    files = []
+    tags = []
+    scores = []
+    if os.path.isfile(result_filename):
+        with open(result_filename, 'rt') as f:
+            for row in csv.reader(f, delimiter=','):
+                if len(row[1]) != 1 or not row[1].isalpha():
+                    raise ValueError('The label identfier "' + row[1] + '" in row ' + str(row) + ' is not valid.')
+                files.append(row[0])
+                tags.append(row[1])
+                scores.append(float(row[2]))
+    else:
+        raise IOError("Result file not found [%s]" % result_filename)
+
+    file_names, file_ids = numpy.unique(files, return_inverse=True)
+    tags = numpy.array(tags)
+    scores = numpy.array(scores)
+
+    # Files are listed in the meta relative to the dataset path
+    audio_path = dataset.package_list[0]['local_audio_path'].replace(dataset.local_path,'')[1:] + os.path.sep
+    file_tags = {}
+
+    for tag_id,tag in enumerate(dataset.audio_tags):
+        rows = numpy.flatnonzero(tags == tag)
+        for file_id in file_ids[rows]:
+            if file_id not in file_tags:
+                file_tags[file_id] = tag_index[audio_path + file_names[file_id]]
+
+        y_true_binary = numpy.array([int(tag in file_tags[file_id]) for file_id in file_ids[rows]], dtype=int)
+
+        if numpy.any(y_true_binary):
+            if len(numpy.unique(file_ids[rows])) != len(rows):
+                raise ValueError('File ' + result_filename + ' contains duplicate score assignments.')
+            class_wise_eer[tag_id] = compute_eer_from_scores(y_true_binary, scores[rows])
+        else:
+            class_wise_eer[tag_id] = None
+
+    return class_wise_eer
+
 if __name__ == "__main__":
     sys.exit(main(sys.argv))